@@ -0,0 +1,77 @@
+"""Benchmark of the serialization of articles to extended JSON.
+
+Serialize batches of 10 to 10,000 articles with gmt.utils.to_json, and with the former
+`json.loads(json_util.dumps(...))` round-trip followed by the Flask JSON response, check that
+both give the same documents and time them.
+
+    python benchmarks/serialization.py [--repeat N]
+"""
+
+import argparse
+import datetime
+import json
+import pathlib
+import sys
+import timeit
+
+from bson import ObjectId, json_util
+from flask import Flask
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from gmt.utils import to_json  # noqa: E402
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def make_article(i: int) -> dict:
+    """Return an article shaped like the ones of the API."""
+    return {
+        "_id": ObjectId(),
+        "title": f"Article {i} about the news of the day",
+        "description": "A few sentences summarizing the article. " * 5,
+        "url": f"https://example.com/news/{i}",
+        "thumbnail": f"https://example.com/images/{i}.jpg",
+        "author": {"name": "Writer", "user_name": "writer"},
+        "views": i,
+        "date": datetime.datetime(2023, 6, 17, 19, 4, 27, (i % 1000) * 1000),
+        "source": "bbc",
+        "formatted_source": "BBC",
+        "categories": ["ai-news", "science-news"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    with app.app_context():
+        for size in SIZES:
+            articles = [make_article(i) for i in range(size)]
+
+            def round_trip():
+                return app.json.response(json.loads(json_util.dumps(articles))).data
+
+            def single_pass():
+                return to_json(articles).encode()
+
+            if json.loads(round_trip()) != json.loads(single_pass()):
+                sys.exit(f"The serializations of {size} articles differ")
+
+            number = max(1, 2000 // size)
+            old, new = (
+                min(timeit.repeat(serialize, number=number, repeat=args.repeat))
+                / number
+                * 1000
+                for serialize in (round_trip, single_pass)
+            )
+            print(
+                f"{size:>6} articles: round-trip {old:8.2f} ms,"
+                f" single pass {new:8.2f} ms, {old / new:.1f}x faster"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Benchmark of the GitHub trending parser.
+
+Parse a saved trending page with the lxml parser of gmt.extras and with the former
+BeautifulSoup parser, check that both extract the same repositories and time them.
+
+    python benchmarks/trending.py [--runs N] [--refresh]
+
+--refresh downloads the current trending page into the fixture first. The former parser
+needs beautifulsoup4, which the app itself no longer depends on.
+"""
+
+import argparse
+import pathlib
+import sys
+import time
+
+import bs4
+import requests
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from gmt.extras import REQUEST_TIMEOUT, scraping_repositories  # noqa: E402
+
+FIXTURE = pathlib.Path(__file__).parent / "fixtures" / "github_trending_daily.html"
+
+
+# the former parser, as it was before the move to lxml
+
+
+def filter_articles(raw_html: str) -> str:
+    """Filters HTML out, which is not enclosed by article-tags.
+    Beautifulsoup is inaccurate and slow when applied on a larger
+    HTML string, this filtration fixes this.
+    """
+    raw_html_lst = raw_html.split("\n")
+
+    # count number of article tags within the document (varies from 0 to 50):
+    article_tags_count = 0
+    tag = "article"
+    for line in raw_html_lst:
+        if tag in line:
+            article_tags_count += 1
+
+    # copy HTML enclosed by first and last article-tag:
+    articles_arrays, is_article = [], False
+    for line in raw_html_lst:
+        if tag in line:
+            article_tags_count -= 1
+            is_article = True
+        if is_article:
+            articles_arrays.append(line)
+        if not article_tags_count:
+            is_article = False
+    return "".join(articles_arrays)
+
+
+def make_soup(articles_html: str) -> bs4.element.ResultSet:
+    """HTML enclosed by article-tags is converted into a
+    soup for further data extraction.
+    """
+    soup = bs4.BeautifulSoup(articles_html, "lxml")
+    return soup.find_all("article", class_="Box-row")
+
+
+def bs4_scraping_repositories(
+    matches: bs4.element.ResultSet,
+    since: str,
+):
+    """Data about all trending repositories are extracted."""
+    trending_repositories = []
+    for rank, match in enumerate(matches):
+        # description
+        if match.p:
+            description = match.p.get_text(strip=True)
+        else:
+            description = None
+
+        # relative url:
+        rel_url = match.select_one("h2 > a")["href"]
+
+        # absolute url:
+        repo_url = "https://github.com" + rel_url
+
+        # name of repo
+        repository_name = rel_url.split("/")[-1]
+
+        # author (username):
+        username = rel_url.split("/")[-2]
+
+        # language and color
+        progr_language = match.find("span", itemprop="programmingLanguage")
+        if progr_language:
+            language = progr_language.get_text(strip=True)
+            lang_color_tag = match.find("span", class_="repo-language-color")
+            lang_color = lang_color_tag["style"].split()[-1]
+        else:
+            lang_color, language = None, None
+
+        stars_built_section = match.div.findNextSibling("div")
+
+        # total stars:
+        if stars_built_section.a:
+            raw_total_stars = stars_built_section.a.get_text(strip=True)
+            if "," in raw_total_stars:
+                raw_total_stars = raw_total_stars.replace(",", "")
+        if raw_total_stars:
+            total_stars: int
+            try:
+                total_stars = int(raw_total_stars)
+            except ValueError as missing_number:
+                print(missing_number)
+        else:
+            total_stars = None
+
+        # forks
+        if stars_built_section.a.findNextSibling("a"):
+            raw_forks = stars_built_section.a.findNextSibling(
+                "a",
+            ).get_text(strip=True)
+            if "," in raw_forks:
+                raw_forks = raw_forks.replace(",", "")
+        if raw_forks:
+            forks: int
+            try:
+                forks = int(raw_forks)
+            except ValueError as missing_number:
+                print(missing_number)
+        else:
+            forks = None
+
+        # stars in period
+        if stars_built_section.find(
+            "span",
+            class_="d-inline-block float-sm-right",
+        ):
+            raw_stars_since = (
+                stars_built_section.find(
+                    "span",
+                    class_="d-inline-block float-sm-right",
+                )
+                .get_text(strip=True)
+                .split()[0]
+            )
+            if "," in raw_stars_since:
+                raw_stars_since = raw_stars_since.replace(",", "")
+        if raw_stars_since:
+            stars_since: int
+            try:
+                stars_since = int(raw_stars_since)
+            except ValueError as missing_number:
+                print(missing_number)
+        else:
+            stars_since = None
+
+        # builtby
+        built_section = stars_built_section.find(
+            "span",
+            class_="d-inline-block mr-3",
+        )
+        if built_section:
+            contributors = stars_built_section.find(
+                "span",
+                class_="d-inline-block mr-3",
+            ).find_all("a")
+            built_by = []
+            for contributor in contributors:
+                contr_data = {}
+                contr_data["username"] = contributor["href"].strip("/")
+                contr_data["url"] = "https://github.com" + contributor["href"]
+                contr_data["avatar"] = contributor.img["src"]
+                built_by.append(dict(contr_data))
+        else:
+            built_by = None
+
+        repositories = {
+            "rank": rank + 1,
+            "username": username,
+            "name": repository_name,
+            "whole_name": username + "/" + repository_name,
+            "url": repo_url,
+            "description": description,
+            "language": language,
+            "language_color": lang_color,
+            "total_stars": total_stars,
+            "forks": forks,
+            "stars_since": stars_since,
+            "since": since,
+            "built_by": built_by,
+        }
+        trending_repositories.append(repositories)
+
+    return trending_repositories
+
+
+def parse_bs4(raw_html: str) -> list:
+    return bs4_scraping_repositories(make_soup(filter_articles(raw_html)), "daily")
+
+
+def parse_lxml(raw_html: str) -> list:
+    return scraping_repositories(raw_html, "daily")
+
+
+def timed(parse, raw_html: str, runs: int) -> float:
+    """Return the mean milliseconds of a parse of the page."""
+    start = time.perf_counter()
+    for _ in range(runs):
+        parse(raw_html)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument(
+        "--refresh", action="store_true", help="download the current trending page"
+    )
+    args = parser.parse_args()
+
+    if args.refresh:
+        response = requests.get(
+            "https://github.com/trending",
+            params={"since": "daily"},
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        FIXTURE.write_text(response.text, encoding="utf-8")
+    raw_html = FIXTURE.read_text(encoding="utf-8")
+
+    expected = parse_bs4(raw_html)
+    repositories = parse_lxml(raw_html)
+    if repositories != expected:
+        for old, new in zip(expected, repositories):
+            if old != new:
+                sys.exit(f"The parsers disagree:\nbs4:  {old}\nlxml: {new}")
+        sys.exit(f"The parsers found {len(expected)} and {len(repositories)} repos")
+    print(f"Both parsers extracted the same {len(repositories)} repositories")
+
+    for name, parse in (("bs4", parse_bs4), ("lxml", parse_lxml)):
+        print(f"{name}: {timed(parse, raw_html, args.runs):.2f} ms per page")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,9 @@ MAIL_USE_TLS = False
 MAIL_USE_SSL = True
 MAIL_USERNAME = "username"
 MAIL_PASSWORD = "password"
+MAIL_WORKERS = 4  # Number of SMTP connections used to send the newsletter
+MAIL_RATE_LIMIT = None  # Maximum newsletter emails per second, None for no limit
+MAIL_BCC_CHUNK_SIZE = 50  # Maximum BCC recipients per newsletter email
 WRITER_WEBHOOK = None  # Webhook where we will get notified on a new application
 OPENAI_API_KEY = "sk-something"  # main summarization API key
 FTP_HOST = "0.0.0.0"
@@ -15,3 +18,14 @@ FTP_PASSWORD = "password"
 ADMIN_USER_EMAILS = ["email@email.com"]  # Users who will have access to the admin panel
 API_NINJA_KEY = ""  # API key for API Ninja, Get it from https://api-ninjas.com/ required for surprise function in email
 INTERFERENCE_API_KEY = ""  # API key for Interference, Get it from https://huggingface.co/docs/api-inference/index
+SUMMARIZER_BATCH_SIZE = 8  # Number of articles summarized at once
+SUMMARIZER_URL = "http://127.0.0.1:5005"  # Summarization worker, started with `flask commands summarizer-worker`
+SESSION_BACKEND = (
+    "mongodb"  # "mongodb", "cookie" (signed cookie) or "memory" (single process only)
+)
+SESSION_MEMORY_SIZE = 10000  # Number of sessions kept by the "memory" backend
+API_RATE_LIMIT = 60  # API requests per minute per API key
+API_RATE_BURST = 10  # API requests an API key can make at once
+API_RATE_LIMIT_SHARED = (
+    False  # Share the API rate limits between workers through MongoDB
+)
@@ -3,17 +3,17 @@ import os
 from flask import Flask, render_template
 from flask_mail import Mail
 from flask_pymongo import PyMongo
-from pymongo import MongoClient
 from flask_wtf.csrf import CSRFProtect
-from flask_session import Session
 from flask_mde import Mde
 from flask_login import LoginManager, UserMixin
 from flask_admin import Admin
 
+from .sessions import SessionBackend
+
 mail = Mail()
 mongo = PyMongo()
 csrf = CSRFProtect()
-sess = Session()
+sess = SessionBackend()
 mde = Mde()
 login_manager = LoginManager()
 admin = Admin(name="Admin Page", template_mode="bootstrap4")
@@ -52,16 +52,22 @@ def load_configuration(app: Flask) -> None:
     - MAIL_USE_SSL: True if SSL is to be used.
     - MAIL_USERNAME: The email address to send the mail from.
     - MAIL_PASSWORD: The password of the email address.
+    - MAIL_WORKERS: The number of SMTP connections used to send the newsletter, defaults to 4.
+    - MAIL_RATE_LIMIT: The maximum number of newsletter emails sent per second, unlimited if unset.
+    - MAIL_BCC_CHUNK_SIZE: The maximum number of BCC recipients of a newsletter email, defaults to 50.
+    - SUMMARIZER_BATCH_SIZE: The number of articles summarized at once, defaults to 8.
+    - SUMMARIZER_URL: The URL of the summarization worker, defaults to http://127.0.0.1:5005.
+    - API_RATE_LIMIT: The number of API requests per minute allowed per API key, defaults to 60.
+    - API_RATE_BURST: The number of API requests an API key can make at once, defaults to 10.
+    - API_RATE_LIMIT_SHARED: True to share the API rate limits between workers through MongoDB.
+    - SESSION_BACKEND: Where the sessions are stored, "mongodb" (default), "cookie" or "memory".
+    - SESSION_MEMORY_SIZE: The number of sessions kept by the "memory" backend, defaults to 10000.
     - WRITER_WEBHOOK: The URL of the Discord webhook to send writer apply requests.
     - FORM_WEBHOOK: The URL of the Discord webhook to send form requests.
     """
     app.config["FLASK_ADMIN_SWATCH"] = "lux"
-    app.config["SESSION_TYPE"] = "mongodb"
-    app.config["SESSION_MONGODB_DB"] = "goodmorningtech"
-    app.config["SESSION_MONGODB_COLLECT"] = "sessions"
     try:
         app.config.from_pyfile("config.py")
-        app.config["SESSION_MONGODB"] = MongoClient(app.config["MONGO_URI"])
     except OSError:
         app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
         app.config["DOMAIN_NAME"] = os.environ.get("DOMAIN_NAME")
@@ -72,6 +78,9 @@ def load_configuration(app: Flask) -> None:
         app.config["MAIL_USE_SSL"] = os.environ.get("MAIL_USE_SSL")
         app.config["MAIL_USERNAME"] = os.environ.get("MAIL_USERNAME")
         app.config["MAIL_PASSWORD"] = os.environ.get("MAIL_PASSWORD")
+        app.config["MAIL_WORKERS"] = os.environ.get("MAIL_WORKERS")
+        app.config["MAIL_RATE_LIMIT"] = os.environ.get("MAIL_RATE_LIMIT")
+        app.config["MAIL_BCC_CHUNK_SIZE"] = os.environ.get("MAIL_BCC_CHUNK_SIZE")
         app.config["WRITER_WEBHOOK"] = os.environ.get("WRITER_WEBHOOK")
         app.config["FORM_WEBHOOK"] = os.environ.get("FORM_WEBHOOK")
         app.config["OPENAI_API_KEY"] = os.environ.get("OPENAI_API_KEY")
@@ -80,15 +89,41 @@ def load_configuration(app: Flask) -> None:
         app.config["FTP_HOST"] = os.environ.get("FTP_HOST")
         app.config["API_NINJA_KEY"] = os.environ.get("API_NINJA_KEY")
         app.config["INTERFERENCE_API_KEY"] = os.environ.get("INTERFERENCE_API_KEY")
+        app.config["SUMMARIZER_BATCH_SIZE"] = os.environ.get("SUMMARIZER_BATCH_SIZE")
+        app.config["SUMMARIZER_URL"] = os.environ.get("SUMMARIZER_URL")
+        app.config["SESSION_BACKEND"] = os.environ.get("SESSION_BACKEND")
+        app.config["API_RATE_LIMIT"] = os.environ.get("API_RATE_LIMIT")
+        app.config["API_RATE_BURST"] = os.environ.get("API_RATE_BURST")
+        app.config["API_RATE_LIMIT_SHARED"] = os.environ.get("API_RATE_LIMIT_SHARED")
+        app.config["SESSION_MEMORY_SIZE"] = os.environ.get("SESSION_MEMORY_SIZE")
         app.config["ADMIN_USER_EMAILS"] = (
             os.environ.get("ADMIN_USER_EMAILS").split(",")
             if os.environ.get("ADMIN_USER_EMAILS")
             else []
         )
-        app.config["SESSION_MONGODB"] = MongoClient(app.config["MONGO_URI"])
 
         if app.config["MAIL_PORT"]:
             app.config["MAIL_PORT"] = int(app.config["MAIL_PORT"])
+        if app.config["MAIL_WORKERS"]:
+            app.config["MAIL_WORKERS"] = int(app.config["MAIL_WORKERS"])
+        if app.config["MAIL_RATE_LIMIT"]:
+            app.config["MAIL_RATE_LIMIT"] = float(app.config["MAIL_RATE_LIMIT"])
+        if app.config["MAIL_BCC_CHUNK_SIZE"]:
+            app.config["MAIL_BCC_CHUNK_SIZE"] = int(app.config["MAIL_BCC_CHUNK_SIZE"])
+        if app.config["SUMMARIZER_BATCH_SIZE"]:
+            app.config["SUMMARIZER_BATCH_SIZE"] = int(
+                app.config["SUMMARIZER_BATCH_SIZE"]
+            )
+        if app.config["SESSION_MEMORY_SIZE"]:
+            app.config["SESSION_MEMORY_SIZE"] = int(app.config["SESSION_MEMORY_SIZE"])
+        if app.config["API_RATE_LIMIT"]:
+            app.config["API_RATE_LIMIT"] = float(app.config["API_RATE_LIMIT"])
+        if app.config["API_RATE_BURST"]:
+            app.config["API_RATE_BURST"] = int(app.config["API_RATE_BURST"])
+        if app.config["API_RATE_LIMIT_SHARED"]:
+            app.config["API_RATE_LIMIT_SHARED"] = (
+                app.config["API_RATE_LIMIT_SHARED"].casefold() == "true"
+            )
         if app.config["MAIL_USE_TLS"]:
             app.config["MAIL_USE_TLS"] = app.config["MAIL_USE_TLS"].casefold() == "true"
         if app.config["MAIL_USE_SSL"]:
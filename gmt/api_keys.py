@@ -0,0 +1,57 @@
+"""Verification of the API keys.
+
+An API key is the id of a subscribed user. Checked keys are remembered in a bounded LRU, valid
+ones for KEY_TTL seconds and unknown ones for UNKNOWN_KEY_TTL seconds, so repeated calls with
+the same key don't look up the user every time.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from bson import ObjectId
+
+from . import mongo
+
+KEY_TTL = 5 * 60  # seconds a valid key is trusted
+UNKNOWN_KEY_TTL = 60  # seconds an unknown key is rejected without a lookup
+MAX_KEYS = 10000  # keys remembered at most
+
+
+class ApiKeyCache:
+    """LRU of checked API keys with their expiry time."""
+
+    def __init__(self, size=MAX_KEYS):
+        self.size = size
+        self.lock = threading.Lock()
+        self.keys = OrderedDict()  # key: (valid, expiry time)
+
+    def is_valid(self, api_key: str) -> bool:
+        """Return whether the key belongs to a user, malformed keys are never valid."""
+        if not ObjectId.is_valid(api_key):
+            return False
+
+        now = time.monotonic()
+        with self.lock:
+            valid, expires = self.keys.get(api_key, (None, 0))
+            if now < expires:
+                self.keys.move_to_end(api_key)
+                return valid
+
+        valid = (
+            mongo.db.users.find_one({"_id": ObjectId(api_key)}, {"_id": 1}) is not None
+        )
+        with self.lock:
+            self.keys[api_key] = (valid, now + (KEY_TTL if valid else UNKNOWN_KEY_TTL))
+            self.keys.move_to_end(api_key)
+            while len(self.keys) > self.size:
+                self.keys.popitem(last=False)
+        return valid
+
+    def forget(self, api_key) -> None:
+        """Drop a key, for example when its user unsubscribes."""
+        with self.lock:
+            self.keys.pop(str(api_key), None)
+
+
+api_keys = ApiKeyCache()
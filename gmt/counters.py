@@ -0,0 +1,84 @@
+"""Page view counters.
+
+Views are counted in memory and written to the database every FLUSH_INTERVAL seconds, as a
+single bulk write of `$inc` operations, instead of one write per page view. The writes are made
+by a background thread started with the first view of the process, and when the process exits.
+The throttled API requests are counted the same way.
+
+Views counted since the last flush are lost if the process is killed. On serverless deployments
+processes are frozen between requests, so the thread doesn't run until the next request, and
+a frozen process can be killed without exiting. To bound this, a view also flushes the counter
+when the last flush is more than FLUSH_INTERVAL seconds old.
+"""
+
+import atexit
+import threading
+import time
+from collections import Counter
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from . import mongo
+
+FLUSH_INTERVAL = 10  # seconds between writes of the counted views
+
+
+class ViewCounter:
+    """Buffer of the views of the documents of a collection, matched by `field`.
+
+    The views are added to the `counter` field of the documents.
+    """
+
+    def __init__(self, collection: str, field: str = "_id", counter: str = "views"):
+        self.collection = collection
+        self.field = field
+        self.counter = counter
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.flushed_at = time.monotonic()
+        self.flusher = None
+        atexit.register(self.flush)
+
+    def hit(self, key) -> None:
+        with self.lock:
+            self.pending[key] += 1
+            due = time.monotonic() - self.flushed_at >= FLUSH_INTERVAL
+            # the thread is started again in forked processes, and if a flush killed it
+            if self.flusher is None or not self.flusher.is_alive():
+                self.flusher = threading.Thread(target=self.run_flusher, daemon=True)
+                self.flusher.start()
+        if due:
+            self.flush()
+
+    def run_flusher(self) -> None:
+        """Flush the views every FLUSH_INTERVAL seconds, in the background."""
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.flushed_at = time.monotonic()
+        if not pending:
+            return
+
+        try:
+            mongo.db[self.collection].bulk_write(
+                [
+                    UpdateOne({self.field: key}, {"$inc": {self.counter: views}})
+                    for key, views in pending.items()
+                ],
+                ordered=False,
+            )
+        except PyMongoError as e:
+            print(f"Failed to write the {self.collection} {self.counter}: {e}")
+            # keep the views for the next flush
+            with self.lock:
+                self.pending.update(pending)
+
+
+article_views = ViewCounter("articles")
+writer_views = ViewCounter("writers", field="user_name")
+api_throttles = ViewCounter("users", counter="api_throttled")
@@ -1,61 +1,66 @@
+import datetime
 import random
-import bs4
+from concurrent.futures import ThreadPoolExecutor
+
+import lxml.html
+import pymongo
 import requests
 from flask import current_app
 
-from .utils import format_html
+from . import mongo
+from .utils import cached, format_html
 
+REQUEST_TIMEOUT = 30
+CHALLENGE_RETRY = 10 * 60  # seconds before LeetCode is asked again after a failure
 
-def filter_articles(raw_html: str) -> str:
-    """Filters HTML out, which is not enclosed by article-tags.
-    Beautifulsoup is inaccurate and slow when applied on a larger
-    HTML string, this filtration fixes this.
-    """
-    raw_html_lst = raw_html.split("\n")
-
-    # count number of article tags within the document (varies from 0 to 50):
-    article_tags_count = 0
-    tag = "article"
-    for line in raw_html_lst:
-        if tag in line:
-            article_tags_count += 1
-
-    # copy HTML enclosed by first and last article-tag:
-    articles_arrays, is_article = [], False
-    for line in raw_html_lst:
-        if tag in line:
-            article_tags_count -= 1
-            is_article = True
-        if is_article:
-            articles_arrays.append(line)
-        if not article_tags_count:
-            is_article = False
-    return "".join(articles_arrays)
-
-
-def make_soup(articles_html: str) -> bs4.element.ResultSet:
-    """HTML enclosed by article-tags is converted into a
-    soup for further data extraction.
-    """
-    soup = bs4.BeautifulSoup(articles_html, "lxml")
-    return soup.find_all("article", class_="Box-row")
+
+def seconds_until_next_utc_day() -> float:
+    """Return the seconds left until the UTC date changes."""
+    now = datetime.datetime.utcnow()
+    tomorrow = datetime.datetime.combine(now.date(), datetime.time.min)
+    tomorrow += datetime.timedelta(days=1)
+    return (tomorrow - now).total_seconds()
+
+
+def challenge_ttl(challenge: dict) -> float:
+    """Keep the challenge of today until the next UTC day, an older one only for a while."""
+    if challenge["date"] == datetime.datetime.utcnow().strftime("%Y-%m-%d"):
+        return seconds_until_next_utc_day()
+    return CHALLENGE_RETRY
+
+
+def _has_class(name: str) -> str:
+    """XPath condition matching elements with the given class."""
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+def _text(element) -> str:
+    """Return the stripped text pieces of an element joined together."""
+    return "".join(text.strip() for text in element.itertext())
+
+
+def _number(text: str):
+    """Convert a number like 1,234 to an int, None if it's missing or not a number."""
+    try:
+        return int(text.replace(",", ""))
+    except (AttributeError, ValueError):
+        return None
 
 
-def scraping_repositories(
-    matches: bs4.element.ResultSet,
-    since: str,
-):
-    """Data about all trending repositories are extracted."""
+def scraping_repositories(raw_html: str, since: str) -> list:
+    """Data about all trending repositories are extracted.
+
+    The raw trending page is parsed with lxml and the repositories are extracted with XPath.
+    """
+    tree = lxml.html.fromstring(raw_html)
     trending_repositories = []
-    for rank, match in enumerate(matches):
+    for rank, match in enumerate(tree.xpath(f"//article[{_has_class('Box-row')}]")):
         # description
-        if match.p:
-            description = match.p.get_text(strip=True)
-        else:
-            description = None
+        description = match.xpath("(.//p)[1]")
+        description = _text(description[0]) if description else None
 
         # relative url:
-        rel_url = match.select_one("h2 > a")["href"]
+        rel_url = match.xpath(".//h2/a/@href")[0]
 
         # absolute url:
         repo_url = "https://github.com" + rel_url
@@ -67,87 +72,44 @@ def scraping_repositories(
         username = rel_url.split("/")[-2]
 
         # language and color
-        progr_language = match.find("span", itemprop="programmingLanguage")
+        progr_language = match.xpath('.//span[@itemprop="programmingLanguage"]')
         if progr_language:
-            language = progr_language.get_text(strip=True)
-            lang_color_tag = match.find("span", class_="repo-language-color")
-            lang_color = lang_color_tag["style"].split()[-1]
+            language = _text(progr_language[0])
+            lang_color = match.xpath(
+                f".//span[{_has_class('repo-language-color')}]/@style"
+            )[0].split()[-1]
         else:
             lang_color, language = None, None
 
-        stars_built_section = match.div.findNextSibling("div")
+        stars_built_section = match.xpath("(.//div)[1]/following-sibling::div[1]")[0]
 
-        # total stars:
-        if stars_built_section.a:
-            raw_total_stars = stars_built_section.a.get_text(strip=True)
-            if "," in raw_total_stars:
-                raw_total_stars = raw_total_stars.replace(",", "")
-        if raw_total_stars:
-            total_stars: int
-            try:
-                total_stars = int(raw_total_stars)
-            except ValueError as missing_number:
-                print(missing_number)
-        else:
-            total_stars = None
-
-        # forks
-        if stars_built_section.a.findNextSibling("a"):
-            raw_forks = stars_built_section.a.findNextSibling(
-                "a",
-            ).get_text(strip=True)
-            if "," in raw_forks:
-                raw_forks = raw_forks.replace(",", "")
-        if raw_forks:
-            forks: int
-            try:
-                forks = int(raw_forks)
-            except ValueError as missing_number:
-                print(missing_number)
-        else:
-            forks = None
+        # total stars and forks
+        links = stars_built_section.xpath(
+            "(.//a)[1] | (.//a)[1]/following-sibling::a[1]"
+        )
+        total_stars = _number(_text(links[0])) if links else None
+        forks = _number(_text(links[1])) if len(links) > 1 else None
 
         # stars in period
-        if stars_built_section.find(
-            "span",
-            class_="d-inline-block float-sm-right",
-        ):
-            raw_stars_since = (
-                stars_built_section.find(
-                    "span",
-                    class_="d-inline-block float-sm-right",
-                )
-                .get_text(strip=True)
-                .split()[0]
-            )
-            if "," in raw_stars_since:
-                raw_stars_since = raw_stars_since.replace(",", "")
-        if raw_stars_since:
-            stars_since: int
-            try:
-                stars_since = int(raw_stars_since)
-            except ValueError as missing_number:
-                print(missing_number)
-        else:
-            stars_since = None
+        stars_since = stars_built_section.xpath(
+            './/span[@class="d-inline-block float-sm-right"]'
+        )
+        stars_since = _number(_text(stars_since[0]).split()[0]) if stars_since else None
 
         # builtby
-        built_section = stars_built_section.find(
-            "span",
-            class_="d-inline-block mr-3",
+        built_section = stars_built_section.xpath(
+            './/span[@class="d-inline-block mr-3"]'
         )
         if built_section:
-            contributors = stars_built_section.find(
-                "span",
-                class_="d-inline-block mr-3",
-            ).find_all("a")
             built_by = []
-            for contributor in contributors:
-                contr_data = {}
-                contr_data["username"] = contributor["href"].strip("/")
-                contr_data["url"] = "https://github.com" + contributor["href"]
-                contr_data["avatar"] = contributor.img["src"]
-                built_by.append(dict(contr_data))
+            for contributor in built_section[0].xpath(".//a"):
+                built_by.append(
+                    {
+                        "username": contributor.get("href").strip("/"),
+                        "url": "https://github.com" + contributor.get("href"),
+                        "avatar": contributor.xpath(".//img/@src")[0],
+                    }
+                )
         else:
             built_by = None
 
@@ -171,69 +133,95 @@ def scraping_repositories(
     return trending_repositories
 
 
+@cached(ttl=60 * 60)
 def get_trending_repos(since="daily"):
     payload = {"since": since}  # "daily", "weekly", "monthly", "yearly"
 
     url = "https://github.com/trending"
-    raw_html = requests.get(url, params=payload).text
+    response = requests.get(url, params=payload, timeout=REQUEST_TIMEOUT)
+    # an error page has no repositories, raise so the previous ones are kept
+    response.raise_for_status()
 
-    articles_html = filter_articles(raw_html)
-    soup = make_soup(articles_html)
-    trending_repos = scraping_repositories(soup, since=payload["since"])
+    trending_repos = scraping_repositories(response.text, since=payload["since"])
 
     return trending_repos[:4]
 
 
-def get_daily_coding_challenge():
+def fetch_daily_coding_challenge() -> dict:
+    """Fetch the daily challenge from LeetCode, the question and its content in one query."""
     headers = {
         "Content-Type": "application/json",
     }
 
     json_data = {
-        "query": "query questionOfToday {\n\tactiveDailyCodingChallengeQuestion {\n\t\tdate\n\t\tuserStatus\n\t\tlink\n\t\tquestion {\n\t\t\tacRate\n\t\t\tdifficulty\n\t\t\tfreqBar\n\t\t\tfrontendQuestionId: questionFrontendId\n\t\t\tisFavor\n\t\t\tpaidOnly: isPaidOnly\n\t\t\tstatus\n\t\t\ttitle\n\t\t\ttitleSlug\n\t\t\thasVideoSolution\n\t\t\thasSolution\n\t\t\ttopicTags {\n\t\t\t\tname\n\t\t\t\tid\n\t\t\t\tslug\n\t\t\t}\n\t\t}\n\t}\n}\n",
+        "query": "query questionOfToday {\n\tactiveDailyCodingChallengeQuestion {\n\t\tdate\n\t\tquestion {\n\t\t\ttitleSlug\n\t\t\tcontent\n\t\t}\n\t}\n}\n",
         "operationName": "questionOfToday",
     }
 
     response = requests.post(
-        "https://leetcode.com/graphql", headers=headers, json=json_data
+        "https://leetcode.com/graphql",
+        headers=headers,
+        json=json_data,
+        timeout=REQUEST_TIMEOUT,
     )
-    json_response = response.json()
-    title_slug = json_response["data"]["activeDailyCodingChallengeQuestion"][
-        "question"
-    ]["titleSlug"]
-
-    json_data = {
-        "query": "\n    query questionContent($titleSlug: String!) {\n  question(titleSlug: $titleSlug) {\n    content\n    mysqlSchemas\n  }\n}\n    ",
-        "variables": {"titleSlug": title_slug},
-        "operationName": "questionContent",
-    }
-
-    response = requests.post(
-        "https://leetcode.com/graphql", headers=headers, json=json_data
-    )
-    json_response = response.json()
+    challenge = response.json()["data"]["activeDailyCodingChallengeQuestion"]
+    title_slug = challenge["question"]["titleSlug"]
 
     title = " ".join(word.capitalize() for word in title_slug.split("-"))
-    raw_content = json_response["data"]["question"]["content"]
+    raw_content = challenge["question"]["content"]
     description = (
         format_html(raw_content).replace("<pre>", "<p>").replace("</pre>", "</p>")
     )
-    return {"title": title, "description": description}
+    return {"date": challenge["date"], "title": title, "description": description}
+
 
+@cached(ttl=challenge_ttl, refresh_ahead=0)
+def get_daily_coding_challenge():
+    """Return the daily challenge of the current UTC day.
 
+    The challenge is stored in the database by date, so LeetCode is only asked once a day.
+    If LeetCode can't be reached the latest stored challenge is returned instead, and LeetCode
+    is asked again after CHALLENGE_RETRY seconds.
+    """
+    today = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+    challenge = mongo.db.challenges.find_one({"_id": today})
+    if not challenge:
+        try:
+            challenge = fetch_daily_coding_challenge()
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            print(f"Failed to get the daily coding challenge: {e}")
+            challenge = mongo.db.challenges.find_one(sort=[("_id", pymongo.DESCENDING)])
+            if not challenge:
+                raise
+        else:
+            challenge["_id"] = challenge.pop("date")
+            mongo.db.challenges.replace_one(
+                {"_id": challenge["_id"]}, challenge, upsert=True
+            )
+    return {
+        "date": challenge["_id"],
+        "title": challenge["title"],
+        "description": challenge["description"],
+    }
+
+
+@cached(ttl=60 * 60)
 def get_surprise():
     randomizer = random.randint(0, 2)
     try:
         if randomizer == 0:
             joke = requests.get(
-                "https://v2.jokeapi.dev/joke/Programming,Miscellaneous,Pun?blacklistFlags=nsfw,religious,racist,sexist,explicit"
+                "https://v2.jokeapi.dev/joke/Programming,Miscellaneous,Pun?blacklistFlags=nsfw,religious,racist,sexist,explicit",
+                timeout=REQUEST_TIMEOUT,
             ).json()
             if joke["type"] == "single":
                 return "Today's joke:\n" + joke["joke"]
             else:
                 return "Today's joke:\n" + joke["setup"] + "\n" + joke["delivery"]
         elif randomizer == 1:
-            quote = requests.get("https://api.quotable.io/quotes/random").json()[0]
+            quote = requests.get(
+                "https://api.quotable.io/quotes/random", timeout=REQUEST_TIMEOUT
+            ).json()[0]
             return "Today's quote:\n" + quote["content"] + "\n-" + quote["author"]
         else:
             api_url = "https://api.api-ninjas.com/v1/facts?limit=1"
@@ -241,9 +229,40 @@ def get_surprise():
                 "X-Api-Key": current_app.config["API_NINJA_KEY"],
                 "Accept": "application/json",
             }
-            response = requests.get(api_url, headers=headers)
+            response = requests.get(api_url, headers=headers, timeout=REQUEST_TIMEOUT)
             fact = response.json()
             return "Today's Fact:\n" + fact[0]["fact"]
     except Exception as e:
         print(e)
         return "Sorry, I couldn't get a surprise for you today :( If this occurs again, please contact us."
+
+
+EXTRAS = {
+    "repositories": get_trending_repos,
+    "codingchallenge": get_daily_coding_challenge,
+    "surprise": get_surprise,
+}
+
+
+def get_extras(names) -> dict:
+    """Fetch a snapshot of the given extras.
+
+    Every extra is fetched once and concurrently with the others, the snapshot is meant to be
+    shared by all the emails of a batch. An extra that fails to load is None, so it is left
+    out of the email instead of stopping the batch.
+    """
+    app = current_app._get_current_object()
+    names = sorted({name for name in names if name in EXTRAS})
+
+    def fetch(name):
+        with app.app_context():
+            try:
+                return EXTRAS[name]()
+            except Exception as e:
+                print(f"Failed to get {name}: {e}")
+                return None
+
+    if not names:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        return dict(zip(names, executor.map(fetch, names)))
@@ -0,0 +1,141 @@
+"""Database indexes.
+
+Every index of the database is declared in INDEXES and built with
+`flask --app gmt commands create-indexes`, which can be run any number of times. The queries
+the indexes are meant for are declared in `query_shapes`, the `--check` flag of the command
+explains them and reports the ones that still scan a whole collection.
+
+The sessions are indexed by the session backend, they may live in another database.
+"""
+
+import datetime
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+from . import mongo
+from .news import PARSER_CACHE_TTL
+
+INDEXES = {
+    "articles": [
+        # the API pages through the articles on (date, _id)
+        IndexModel([("date", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("source", ASCENDING), ("date", DESCENDING)]),
+        IndexModel([("author.email", ASCENDING)]),
+        IndexModel([("author.user_name", ASCENDING)]),
+        # articles are deduplicated by their normalized URL, older articles may lack it
+        IndexModel(
+            [("url_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"url_key": {"$exists": True}},
+        ),
+    ],
+    "users": [
+        # the email is unique, so it also serves the queries on the email and `confirmed`
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel(
+            [("send_slot", ASCENDING), ("send_days", ASCENDING)],
+            partialFilterExpression={"confirmed": True},
+        ),
+    ],
+    "writers": [
+        IndexModel([("email", ASCENDING)], unique=True),
+        # writers only choose a user name once they are accepted, until then it's None
+        IndexModel(
+            [("user_name", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"user_name": {"$gt": ""}},
+        ),
+    ],
+    "deliveries": [
+        IndexModel([("run", ASCENDING)]),
+        IndexModel([("date", ASCENDING)], expireAfterSeconds=7 * 24 * 60 * 60),
+    ],
+    # the claimed email batches, kept as long as their deliveries
+    "email_runs": [
+        IndexModel([("date", ASCENDING)], expireAfterSeconds=7 * 24 * 60 * 60),
+    ],
+    # an idle bucket is full again long before it expires
+    "rate_limits": [
+        IndexModel([("updated", ASCENDING)], expireAfterSeconds=60 * 60),
+    ],
+    "webhooks": [
+        IndexModel([("api_key", ASCENDING), ("url", ASCENDING)], unique=True),
+    ],
+    "parser_cache": [
+        IndexModel([("date", ASCENDING)], expireAfterSeconds=PARSER_CACHE_TTL),
+    ],
+}
+
+
+def query_shapes() -> list:
+    """Return the frequent queries as (collection, filter, sort) tuples."""
+    yesterday = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+    return [
+        ("articles", {"date": {"$gte": yesterday}}, None),
+        ("articles", {}, [("date", DESCENDING)]),
+        (
+            "articles",
+            {"date": {"$gte": yesterday}},
+            [("date", DESCENDING), ("_id", DESCENDING)],
+        ),
+        ("articles", {"source": {"$in": ["gmt"]}, "date": {"$gte": yesterday}}, None),
+        ("articles", {"author.email": "writer@example.com"}, None),
+        ("articles", {"author.user_name": "writer"}, None),
+        ("articles", {"url_key": ""}, None),
+        ("users", {"email": "reader@example.com", "confirmed": True}, None),
+        ("users", {"confirmed": True, "send_slot": "00:00", "send_days": 1}, None),
+        ("writers", {"email": "writer@example.com", "accepted": True}, None),
+        ("writers", {"user_name": "writer", "accepted": True, "confirmed": True}, None),
+        ("deliveries", {"run": "", "sent": False}, None),
+        ("parser_cache", {"_id": ""}, None),
+    ]
+
+
+def create_indexes(collections=None) -> int:
+    """Build the declared indexes of the given collections, all of them by default.
+
+    Indexes that already exist are left alone. An index that can't be built, for example a
+    unique index over duplicate documents, is reported and the others are still built.
+    Return the number of indexes that failed.
+    """
+    failed = 0
+    for collection in collections or INDEXES:
+        for index in INDEXES[collection]:
+            try:
+                mongo.db[collection].create_indexes([index])
+            except PyMongoError as e:
+                print(f"Failed to build the index {index.document['name']}: {e}")
+                failed += 1
+    return failed
+
+
+def _plan_stages(plan) -> set:
+    """Return every stage of an explained query plan."""
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages |= _plan_stages(value)
+    return stages
+
+
+def check_queries() -> list:
+    """Explain the declared queries, return the ones scanning a collection or sorting in memory.
+
+    Every problem is returned as a (collection, filter, sort, stages) tuple.
+    """
+    problems = []
+    for collection, query, sort in query_shapes():
+        cursor = mongo.db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(plan) & {"COLLSCAN", "SORT"}
+        if stages:
+            problems.append((collection, query, sort, stages))
+    return problems
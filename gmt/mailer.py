@@ -0,0 +1,124 @@
+"""Newsletter dispatch.
+
+The messages of a batch are sent by a small pool of worker threads. Every worker keeps its own
+SMTP connection open for as long as there are messages left, instead of connecting once per
+message like `mail.send` does.
+"""
+
+import queue
+import threading
+import time
+from smtplib import SMTPException
+
+from flask import current_app
+
+from . import mail
+
+MAX_ATTEMPTS = 2  # a message that fails is retried once on a new connection
+MAX_CONNECTION_ERRORS = 3  # a worker stops after this many errors in a row
+
+
+class RateLimiter:
+    """Space out calls so at most `rate` of them happen per second, across all threads."""
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class DispatchStats:
+    """Thread safe counters of a dispatch run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def add(self, sent=0, failed=0) -> None:
+        with self.lock:
+            self.sent += sent
+            self.failed += failed
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.started
+        throughput = self.sent / elapsed if elapsed else 0
+        return (
+            f"Sent {self.sent} email{'s' if self.sent!=1 else ''} in {elapsed:.1f}s "
+            f"({throughput:.2f}/s), {self.failed} failed"
+        )
+
+
+def _dispatch(app, jobs, limiter, stats, on_sent) -> None:
+    """Send messages from the queue until it's empty, reconnecting after SMTP errors."""
+    with app.app_context():
+        message, attempts, errors = None, 0, 0
+        while errors < MAX_CONNECTION_ERRORS:
+            try:
+                with mail.connect() as connection:
+                    while True:
+                        if message is None:
+                            message, attempts = jobs.get_nowait(), 0
+                        limiter.wait()
+                        attempts += 1
+                        connection.send(message)
+                        stats.add(sent=1)
+                        if on_sent:
+                            on_sent(message)
+                        message, errors = None, 0
+            except queue.Empty:
+                return
+            except (SMTPException, OSError) as e:
+                print(f"Failed to send email: {e}")
+                errors += 1
+                if message is not None and attempts >= MAX_ATTEMPTS:
+                    stats.add(failed=1)
+                    message = None
+
+        # give the current message back, another worker might still be able to send it
+        if message is not None:
+            jobs.put(message)
+
+
+def send_messages(messages, workers=None, rate=None, on_sent=None) -> DispatchStats:
+    """Send the messages from a pool of long-lived SMTP connections.
+
+    `workers` is the number of concurrent connections and `rate` the maximum number of
+    messages per second over all of them, they default to the MAIL_WORKERS and MAIL_RATE_LIMIT
+    settings. `on_sent` is called from the worker thread with every message that went out.
+    Messages that could not be sent are counted as failed in the returned stats.
+    """
+    workers = workers or current_app.config.get("MAIL_WORKERS") or 4
+    rate = rate or current_app.config.get("MAIL_RATE_LIMIT")
+
+    jobs = queue.Queue()
+    for message in messages:
+        jobs.put(message)
+
+    app = current_app._get_current_object()
+    limiter = RateLimiter(rate)
+    stats = DispatchStats()
+    threads = [
+        threading.Thread(target=_dispatch, args=(app, jobs, limiter, stats, on_sent))
+        for _ in range(min(workers, jobs.qsize()))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # messages left over when every worker gave up
+    stats.add(failed=jobs.qsize())
+    print(stats.report())
+    return stats
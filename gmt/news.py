@@ -1,12 +1,166 @@
+import itertools
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 import re
+import datetime
 import feedparser
+import pymongo
 import requests
+from pymongo.errors import PyMongoError
+from requests.adapters import HTTPAdapter
+
+from . import mongo
+from .utils import normalize_url
+
+PARSER_URL = "https://parser.goodmorningtech.news/parse"
+MAX_WORKERS = 16  # concurrent requests over all hosts
+DEFAULT_HOST_LIMIT = 4  # concurrent requests to a single host
+HOST_LIMITS = {"parser.goodmorningtech.news": 8}
+REQUEST_TIMEOUT = 30
+PARSER_CACHE_TTL = 3 * 24 * 60 * 60  # seconds a parser response is reused
+PARSER_CACHE_SIZE = 5000  # parser responses kept at most
+PARSER_FIELDS = {"lead_image_url", "title", "content", "date_published", "author"}
+# the fields of the feed entries stored with the validators of the feed
+FEED_ENTRY_FIELDS = ("id", "link", "title", "published", "updated")
+
+# A single session, so connections to the feeds and the parser are reused between requests
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_maxsize=MAX_WORKERS))
+session.mount("https://", HTTPAdapter(pool_maxsize=MAX_WORKERS))
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def fetch(url, **kwargs) -> requests.Response:
+    """GET a URL with the shared session.
+
+    The number of concurrent requests per host is limited by HOST_LIMITS, this replaces
+    sleeping between requests to stay polite to the feeds and the parser.
+    """
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(
+                HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT)
+            )
+        semaphore = _host_semaphores[host]
+
+    with semaphore:
+        return session.get(url, timeout=REQUEST_TIMEOUT, **kwargs)
+
+
+class ParserCache:
+    """Cache of the parser responses in MongoDB, keyed by the normalized article URL.
+
+    Responses expire after PARSER_CACHE_TTL seconds, through the TTL index declared in
+    `indexes`, and only the newest PARSER_CACHE_SIZE are kept. Database errors are treated as
+    misses, the parser is then called as usual.
+    """
+
+    def __init__(self, collection="parser_cache"):
+        self.collection_name = collection
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def collection(self):
+        return mongo.db[self.collection_name]
+
+    def get(self, url):
+        try:
+            entry = self.collection.find_one({"_id": normalize_url(url)})
+        except PyMongoError as e:
+            print(f"Failed to read the parser cache: {e}")
+            entry = None
+        with self.lock:
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry["data"] if entry else None
+
+    def set(self, url, data) -> None:
+        try:
+            self.collection.replace_one(
+                {"_id": normalize_url(url)},
+                {"data": data, "date": datetime.datetime.utcnow()},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            print(f"Failed to write the parser cache: {e}")
+
+    def prune(self) -> None:
+        """Delete the oldest responses above PARSER_CACHE_SIZE."""
+        try:
+            oldest = self.collection.find({}, {"_id": 1}).sort(
+                "date", pymongo.DESCENDING
+            )
+            expired = [entry["_id"] for entry in oldest.skip(PARSER_CACHE_SIZE)]
+            if expired:
+                self.collection.delete_many({"_id": {"$in": expired}})
+        except PyMongoError as e:
+            print(f"Failed to prune the parser cache: {e}")
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.hits = self.misses = 0
+
+
+parser_cache = ParserCache()
+
+
+def get_cached_feed(url):
+    """Return the validators and entries stored for a feed, None if there are none."""
+    try:
+        cached = mongo.db.feed_cache.find_one({"_id": url})
+    except PyMongoError as e:
+        print(f"Failed to read the feed cache: {e}")
+        return None
+    if cached:
+        cached["entries"] = [
+            feedparser.FeedParserDict(entry) for entry in cached["entries"]
+        ]
+    return cached
+
+
+def set_cached_feed(url, etag, modified, entries) -> None:
+    """Store the validators and the entries of a feed, only the FEED_ENTRY_FIELDS are kept."""
+    entries = [
+        {
+            field: entry[field]
+            for field in FEED_ENTRY_FIELDS
+            if isinstance(entry.get(field), str)
+        }
+        for entry in entries
+    ]
+    try:
+        mongo.db.feed_cache.replace_one(
+            {"_id": url},
+            {
+                "etag": etag,
+                "modified": modified,
+                "entries": entries,
+                "date": datetime.datetime.utcnow(),
+            },
+            upsert=True,
+        )
+    except PyMongoError as e:
+        print(f"Failed to write the feed cache: {e}")
 
 
 def get_posts(choice):
-    """Get the posts from different RSS feeds."""
+    """Get the posts from different RSS feeds.
+
+    The feeds are requested with the ETag and Last-Modified headers of their last download,
+    which are stored in the `feed_cache` collection with the entries, so they carry over from
+    one run of the commands to the next. When the server answers 304 the stored entries are
+    returned without downloading or parsing the feed.
+    """
     # Read the JSON file to get the variables and URL of the RSS feed, it looks like this
     # load the JSON file in the Flask app
     with open("rss.json") as f:
@@ -14,55 +168,121 @@ def get_posts(choice):
 
     # Get the URL of the RSS feed
     url = rss[choice]["url"]
+
+    # Ask for the feed only if it changed since the last download
+    cached = get_cached_feed(url)
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("modified"):
+        headers["If-Modified-Since"] = cached["modified"]
+
+    response = fetch(url, headers=headers)
+    if response.status_code == 304 and cached:
+        return cached["entries"]
+
     # Get the feed
-    feed = feedparser.parse(url)
+    feed = feedparser.parse(response.content)
+    if response.status_code == 200:
+        set_cached_feed(
+            url,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            feed.entries,
+        )
 
     return feed.entries
 
 
-def convert_posts(posts, source, limit=8):
-    """Convert the posts to a dict"""
-    # Get the data from the posts
-    data = []
-    for post in posts[:limit]:
-        link = re.sub(r"[^\x00-\x7F]+", "", post.link)
-        raw = requests.get(f"https://parser.goodmorningtech.news/parse?url={link}")
-        try:
-            raw = raw.json()
-        except json.decoder.JSONDecodeError:
-            continue
+def convert_post(post, source):
+    """Convert a post to a dict, None if it can't be parsed or isn't from today."""
+    link = re.sub(r"[^\x00-\x7F]+", "", post.link)
+    try:
+        raw = parser_cache.get(link)
+        if raw is None:
+            response = fetch(PARSER_URL, params={"url": link})
+            response.raise_for_status()
+            raw = response.json()
+            # only complete responses are cached, errors are retried on the next run
+            if not isinstance(raw, dict) or not PARSER_FIELDS <= raw.keys():
+                return None
+            parser_cache.set(link, raw)
         image = raw["lead_image_url"]
         title = raw["title"]
         description = raw["content"]
         date = raw["date_published"]
         author = raw["author"]
+    except (requests.RequestException, json.decoder.JSONDecodeError, KeyError):
+        return None
 
-        # Check if the post is from today UTC, the date is in YYYY-MM-DDTHH:MM:SS.000Z format
-        from datetime import datetime
-        from time import sleep
-
-        if not date or date[:10] == datetime.utcnow().strftime("%Y-%m-%d"):
-            data.append(
-                {
-                    "title": title,
-                    "description": description,
-                    "url": post.link,
-                    "thumbnail": image,
-                    "author": author,
-                    "source": source,
-                }
-            )
-        else:
+    # Check if the post is from today UTC, the date is in YYYY-MM-DDTHH:MM:SS.000Z format
+    if date and date[:10] != datetime.datetime.utcnow().strftime("%Y-%m-%d"):
+        return None
+    return {
+        "title": title,
+        "description": description,
+        "url": post.link,
+        "thumbnail": image,
+        "author": author,
+        "source": source,
+    }
+
+
+def convert_posts(posts, source, limit=8):
+    """Convert the posts to a dict"""
+    # Get the data from the posts, the parser is called for all of them at once
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        data = executor.map(lambda post: convert_post(post, source), posts[:limit])
+        return [post for post in data if post]
+
+
+def iter_new_posts(choice, known_keys: set):
+    """Yield the feed entries of a source whose normalized URL isn't in `known_keys`.
+
+    The feed is only downloaded once the first entry is requested, every yielded URL is added
+    to `known_keys` so a story posted by several sources is only yielded once.
+    """
+    try:
+        posts = get_posts(choice)
+    except requests.RequestException as e:
+        print(f"Failed to get the {choice} feed: {e}")
+        return
+    for post in posts:
+        url_key = normalize_url(post.link)
+        if url_key in known_keys:
             continue
-        sleep(1)
+        known_keys.add(url_key)
+        yield post
+
+
+def take_news(posts, source, amount) -> list:
+    """Convert posts from the iterator until `amount` of them are from today.
+
+    Only as many posts as are still missing are sent to the parser at a time, so the rest of
+    the feed isn't parsed once enough news are found.
+    """
+    news = []
+    while len(news) < amount:
+        window = list(itertools.islice(posts, amount - len(news)))
+        if not window:
+            break
+        news.extend(convert_posts(window, source=source, limit=len(window)))
+    return news
 
-    return data
 
+def get_fresh_news(sources: dict, amounts: dict) -> dict:
+    """Take the given amount of news from every source iterator, all sources concurrently.
 
-def get_news(choice, limit=8):
-    """Get the news"""
-    # Get the posts
-    posts = get_posts(choice)
-    # Convert the posts to a dict
-    data = convert_posts(posts, source=choice, limit=limit)
-    return data
+    `sources` maps the source names to post iterators such as `iter_new_posts`, and `amounts`
+    to the number of news still needed. A source may return fewer news once its feed is
+    exhausted.
+    """
+    choices = [choice for choice in sources if amounts.get(choice, 0) > 0]
+    if not choices:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(choices)) as executor:
+        news = executor.map(
+            lambda choice: take_news(sources[choice], choice, amounts[choice]),
+            choices,
+        )
+        return dict(zip(choices, news))
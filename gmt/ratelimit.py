@@ -0,0 +1,119 @@
+"""Rate limiting of the API.
+
+Every API key has a token bucket holding up to API_RATE_BURST requests, refilled with
+API_RATE_LIMIT requests per minute. The buckets are kept in the memory of the process, so with
+several workers every worker allows the full rate. With API_RATE_LIMIT_SHARED the buckets are
+kept in the `rate_limits` collection instead and shared by all workers, the process-local
+buckets are then only used while the database can't be reached.
+"""
+
+import threading
+import time
+
+from flask import current_app
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from . import mongo
+
+DEFAULT_RATE = 60  # requests per minute
+DEFAULT_BURST = 10  # requests at once
+MAX_BUCKETS = 10000  # process-local buckets kept before the full ones are dropped
+
+
+class TokenBuckets:
+    """Process-local token buckets, by key."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}  # key: (tokens, update time)
+
+    def take(self, key, rate: float, burst: int) -> float:
+        """Take a token from the bucket of the key, `rate` is in tokens per second.
+
+        Return 0 if a token was taken, or else the seconds until the next token.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+
+            # drop the buckets that are full again, they are the same as new ones
+            if len(self.buckets) > MAX_BUCKETS:
+                self.buckets = {
+                    k: (t, u)
+                    for k, (t, u) in self.buckets.items()
+                    if t + (now - u) * rate < burst
+                }
+        return 0 if allowed else (1 - tokens) / rate
+
+
+class MongoTokenBuckets:
+    """Token buckets in a collection, updated atomically so all workers share them."""
+
+    def __init__(self, collection="rate_limits"):
+        self.collection_name = collection
+
+    def take(self, key, rate: float, burst: int) -> float:
+        # the clock of the database, so the buckets don't depend on the clocks of the workers
+        now = "$$NOW"
+        elapsed = {
+            "$divide": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, 1000]
+        }
+        bucket = mongo.db[self.collection_name].find_one_and_update(
+            {"_id": key},
+            [
+                {
+                    "$set": {
+                        "tokens": {
+                            "$min": [
+                                burst,
+                                {
+                                    "$add": [
+                                        {"$ifNull": ["$tokens", burst]},
+                                        {"$multiply": [elapsed, rate]},
+                                    ]
+                                },
+                            ]
+                        },
+                        "updated": now,
+                    }
+                },
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {
+                    "$set": {
+                        "tokens": {
+                            "$cond": [
+                                "$allowed",
+                                {"$subtract": ["$tokens", 1]},
+                                "$tokens",
+                            ]
+                        }
+                    }
+                },
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return 0 if bucket["allowed"] else (1 - bucket["tokens"]) / rate
+
+
+local_buckets = TokenBuckets()
+shared_buckets = MongoTokenBuckets()
+
+
+def retry_after(api_key: str) -> float:
+    """Take a request from the bucket of the key.
+
+    Return 0 if the request is allowed, or else the seconds until the key may call again.
+    """
+    rate = (current_app.config.get("API_RATE_LIMIT") or DEFAULT_RATE) / 60
+    burst = current_app.config.get("API_RATE_BURST") or DEFAULT_BURST
+    if current_app.config.get("API_RATE_LIMIT_SHARED"):
+        try:
+            return shared_buckets.take(api_key, rate, burst)
+        except PyMongoError as e:
+            print(f"Failed to use the shared rate limit: {e}")
+    return local_buckets.take(api_key, rate, burst)
@@ -0,0 +1,162 @@
+"""Session backends.
+
+The backend is chosen with the SESSION_BACKEND setting:
+- mongodb: the session is stored in the `goodmorningtech.sessions` collection, the default.
+- cookie: the session is stored in a signed cookie, nothing is stored on the server. The session
+  only holds the small `confirmed` flag and the login, so it fits in a cookie.
+- memory: the session is stored in the memory of the process, the least recently used sessions
+  are dropped above SESSION_MEMORY_SIZE. Only for deployments running a single process.
+
+With the server-side backends nothing is read for a visitor without a session cookie, and
+nothing is written until something is stored in the session, an empty session doesn't even get
+the permanent flag so Flask-Login sees it as empty too. After that the session is only
+written again when it changes, so it expires PERMANENT_SESSION_LIFETIME after the last change.
+The CSRF token of a form is stored in the session, so the pages with a POST form, like the
+subscribe page, still create a session on the first visit. The homepage has none for that reason.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from flask_session.sessions import (
+    MongoDBSessionInterface,
+    ServerSideSession,
+    SessionInterface,
+)
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+DEFAULT_MEMORY_SIZE = 10000  # sessions kept by the memory backend
+
+
+class LazyMongoDBSessionInterface(MongoDBSessionInterface):
+    """MongoDB sessions that are only written when they change.
+
+    The collection is indexed on the session id, and expired sessions are deleted by a TTL
+    index instead of only when they are opened again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.indexed = False
+
+    def create_indexes(self) -> None:
+        try:
+            self.store.create_index("id", unique=True)
+            self.store.create_index("expiration", expireAfterSeconds=0)
+        except PyMongoError as e:
+            print(f"Failed to index the sessions: {e}")
+        self.indexed = True
+
+    def open_session(self, app, request):
+        session = super().open_session(app, request)
+        # a new session only holds the permanent flag, leave it empty until something is stored
+        if session is not None and list(session) == ["_permanent"]:
+            session.clear()
+            session.modified = False
+        return session
+
+    def save_session(self, app, session, response):
+        if not session.modified:
+            return
+        if not self.indexed:
+            self.create_indexes()
+        if session and self.permanent:
+            session.permanent = True
+        super().save_session(app, session, response)
+
+
+class MemorySession(ServerSideSession):
+    pass
+
+
+class MemorySessionInterface(SessionInterface):
+    """Sessions kept in a process-local LRU of `size` sessions."""
+
+    session_class = MemorySession
+
+    def __init__(self, size=DEFAULT_MEMORY_SIZE, permanent=True):
+        self.size = size
+        self.permanent = permanent
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if not sid:
+            return self.session_class(sid=self._generate_sid())
+
+        with self.lock:
+            data, expiration = self.sessions.get(sid, (None, None))
+            if data is not None and expiration and expiration <= datetime.utcnow():
+                del self.sessions[sid]
+                data = None
+            elif data is not None:
+                self.sessions.move_to_end(sid)
+
+        if data is None:
+            return self.session_class(sid=sid)
+        return self.session_class(dict(data), sid=sid)
+
+    def save_session(self, app, session, response):
+        if not session.modified:
+            return
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            with self.lock:
+                self.sessions.pop(session.sid, None)
+            response.delete_cookie(
+                app.config["SESSION_COOKIE_NAME"], domain=domain, path=path
+            )
+            return
+
+        if self.permanent:
+            session.permanent = True
+        expires = self.get_expiration_time(app, session)
+        expiration = expires.replace(tzinfo=None) if expires else None
+        with self.lock:
+            self.sessions[session.sid] = (dict(session), expiration)
+            self.sessions.move_to_end(session.sid)
+            while len(self.sessions) > self.size:
+                self.sessions.popitem(last=False)
+
+        response.set_cookie(
+            app.config["SESSION_COOKIE_NAME"],
+            session.sid,
+            expires=expires,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+class SessionBackend:
+    """Set the session interface of the app from the SESSION_BACKEND setting."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        backend = app.config.get("SESSION_BACKEND") or "mongodb"
+        if backend == "cookie":
+            app.session_interface = SecureCookieSessionInterface()
+        elif backend == "memory":
+            app.session_interface = MemorySessionInterface(
+                app.config.get("SESSION_MEMORY_SIZE") or DEFAULT_MEMORY_SIZE
+            )
+        elif backend == "mongodb":
+            app.session_interface = LazyMongoDBSessionInterface(
+                MongoClient(app.config["MONGO_URI"]),
+                db="goodmorningtech",
+                collection="sessions",
+                key_prefix="session:",
+            )
+        else:
+            raise ValueError(f"Unknown session backend: {backend}")
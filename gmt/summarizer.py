@@ -0,0 +1,190 @@
+"""News summarization.
+
+The summaries are made with a local transformers pipeline, the articles are passed to the model
+in batches so it doesn't sit idle between them.
+Loading the model takes a while, it can be kept loaded by a resident worker (see `serve`),
+which is used instead of loading the model again whenever it is running.
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from flask import current_app
+
+MODEL = "facebook/bart-large-cnn"
+MAX_ATTEMPTS = 3
+DEFAULT_WORKER_URL = "http://127.0.0.1:5005"
+WORKER_TIMEOUT = 5 * 60  # seconds a batch may take on the worker before it's retried
+# the pipeline options a worker accepts from its clients
+WORKER_OPTIONS = {"max_length", "min_length", "truncation", "batch_size"}
+
+LINK_PATTERN = re.compile(
+    r"""(?i)\b((?:https?:(?:/{1,3}|[a-z0-9%])|[a-z0-9.\-]+[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)/)(?:[^\s()<>{}\[\]]+|\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\))+(?:\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\)|[^\s`!()\[\]{};:'".,<>?«»“”‘’])|(?:(?<!@)[a-z0-9]+(?:[.\-][a-z0-9]+)*[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)\b/?(?!@)))"""
+)
+IMAGE_PATTERN = re.compile(
+    r"!?\[([^\]]*)\]\(([^\)]+)(\.jpg|\.webp|\.png)\)", flags=re.M
+)
+
+
+def clean_description(description: str) -> str:
+    """Remove the links and the images from an article before summarizing it."""
+    for link in LINK_PATTERN.findall(description):
+        # Replace the link with a Markdown link
+        # description = description.replace(link, f"[link]({link})")
+        description = description.replace(link, "")
+    return IMAGE_PATTERN.sub("", description)
+
+
+class RemoteSummarizer:
+    """Client of a summarization worker, called like the pipeline it replaces.
+
+    A call that gets no answer within WORKER_TIMEOUT raises like a failed call, so a worker that
+    hangs is retried like one that fails.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def __call__(self, descriptions, **options):
+        response = self.session.post(
+            f"{self.url}/summarize",
+            json={"descriptions": descriptions, "options": options},
+            timeout=WORKER_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()["summaries"]
+
+    def is_running(self) -> bool:
+        try:
+            return self.session.get(f"{self.url}/health", timeout=2).ok
+        except requests.RequestException:
+            return False
+
+
+def load_pipeline():
+    """Load the summarization pipeline, this takes a while and over a gigabyte of memory."""
+    from transformers import pipeline
+
+    return pipeline("summarization", model=MODEL)
+
+
+def load_summarizer():
+    """Return the worker at SUMMARIZER_URL if it's running, otherwise load the pipeline."""
+    worker = RemoteSummarizer(
+        current_app.config.get("SUMMARIZER_URL") or DEFAULT_WORKER_URL
+    )
+    if worker.is_running():
+        print(f"Using the summarization worker at {worker.url}")
+        return worker
+    print("No summarization worker running, loading the model")
+    return load_pipeline()
+
+
+def serve(host: str, port: int) -> None:
+    """Load the model once and serve summaries over HTTP until interrupted.
+
+    POST /summarize takes {"descriptions": [...], "options": {...}} and returns the output of
+    the pipeline as {"summaries": [...]}, GET /health answers as soon as the model is loaded.
+    Requests are handled one at a time by the model, batching happens on the client side.
+    """
+    summarizer = load_pipeline()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status, data):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self.send_json(404, {"error": "Not found"})
+            self.send_json(200, {"model": MODEL})
+
+        def do_POST(self):
+            if self.path != "/summarize":
+                return self.send_json(404, {"error": "Not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                descriptions = payload["descriptions"]
+                options = {
+                    key: value
+                    for key, value in payload.get("options", {}).items()
+                    if key in WORKER_OPTIONS
+                }
+            except (ValueError, KeyError, AttributeError):
+                return self.send_json(400, {"error": "Invalid request"})
+
+            try:
+                with lock:
+                    output = summarizer(descriptions, **options)
+            except Exception as e:
+                return self.send_json(500, {"error": str(e)})
+            self.send_json(200, {"summaries": output})
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Summarization worker listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _summarize_batch(summarizer, descriptions):
+    """Summarize a batch, retrying with an exponential backoff if the model fails."""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            output = summarizer(
+                descriptions,
+                max_length=300,
+                min_length=150,
+                truncation=True,
+                batch_size=len(descriptions),
+            )
+            return [summary["summary_text"] for summary in output]
+        except Exception as e:
+            print(f"Failed to summarize news, trying again {e}")
+            time.sleep(2**attempt)
+    return None
+
+
+def summarize(summarizer, descriptions, batch_size=None) -> list:
+    """Summarize the descriptions in batches of `batch_size`, SUMMARIZER_BATCH_SIZE by default.
+
+    Returns a summary for every description, None where the summarization failed or returned
+    no text. A batch that keeps failing is summarized one description at a time, so a single
+    bad article doesn't take the whole batch down.
+    """
+    batch_size = batch_size or current_app.config.get("SUMMARIZER_BATCH_SIZE") or 8
+    descriptions = [clean_description(description) for description in descriptions]
+
+    summaries = []
+    for i in range(0, len(descriptions), batch_size):
+        batch = descriptions[i : i + batch_size]
+        started = time.monotonic()
+        output = _summarize_batch(summarizer, batch)
+        if output is None and len(batch) > 1:
+            output = [
+                (_summarize_batch(summarizer, [description]) or [None])[0]
+                for description in batch
+            ]
+        elif output is None:
+            output = [None]
+        elapsed = time.monotonic() - started
+        print(
+            f"Summarized a batch of {len(batch)} in {elapsed:.1f}s "
+            f"({len(batch) / elapsed:.2f} articles/s)"
+        )
+        summaries.extend(summary or None for summary in output)
+    return summaries
@@ -1,8 +1,19 @@
+import datetime
+import functools
 import html
 import json
 import random
+import re
+import threading
+import time
+from concurrent.futures import Future
 from ftplib import FTP
-from bson import json_util
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import arrow
+from bson import ObjectId, json_util
+from flask import current_app
+from markdown import markdown
 
 
 def clean_html(html_string):
@@ -15,8 +26,95 @@ def clean_html(html_string):
     )
 
 
-def parse_json(data):
-    return json.loads(json_util.dumps(data))
+# the fields of an article served by the API and sent to the webhooks
+ARTICLE_FIELDS = (
+    "title",
+    "description",
+    "content",
+    "url",
+    "thumbnail",
+    "author",
+    "date",
+    "source",
+    "formatted_source",
+    "categories",
+    "views",
+)
+
+
+def render_teaser(description: str) -> str:
+    """Render the first 360 characters of a description, without cutting a [link] tag."""
+    # set limits for the description to 360 characters and add more length for each [link] tag
+    limit = 360 + description[:360].count("[link]") * 30
+    teaser = description[:limit]
+
+    # remove unterminated [link] tags
+    teaser = re.sub(r"\[link\]\([^\)]*[^\)]$", "", teaser)
+
+    # add ellipses and markdown it
+    return markdown(teaser + "...")
+
+
+def render_article(article: dict) -> dict:
+    """Return the rendered HTML fields of an article.
+
+    The Markdown of an article is rendered once, when it's written, into `description_html`,
+    `teaser_html` (the homepage excerpt) and `content_html` for articles with content.
+    """
+    rendered = {
+        "description_html": markdown(article["description"]),
+        "teaser_html": render_teaser(article["description"]),
+    }
+    if article.get("content"):
+        rendered["content_html"] = markdown(article["content"])
+    return rendered
+
+
+def _bson_default(obj):
+    """Encode the BSON types of a document the way relaxed extended JSON does."""
+    if isinstance(obj, ObjectId):
+        return {"$oid": str(obj)}
+    if isinstance(obj, datetime.datetime) and obj.tzinfo is None and obj.year >= 1970:
+        # pymongo returns naive UTC datetimes with millisecond precision, aware ones are left
+        # to json_util which writes their offset
+        millis = obj.microsecond // 1000
+        date = obj.strftime("%Y-%m-%dT%H:%M:%S")
+        return {"$date": f"{date}.{millis:03d}Z" if millis else f"{date}Z"}
+    return json_util.default(obj)
+
+
+_json_encoder = json.JSONEncoder(default=_bson_default, separators=(",", ":"))
+
+
+def to_json(data) -> str:
+    """Serialize documents to relaxed extended JSON in a single pass.
+
+    ObjectIds become `{"$oid": "..."}` and dates `{"$date": "2023-06-17T19:04:27.069Z"}`, the
+    same output as `bson.json_util.dumps` without its separators, other BSON types are left
+    to `json_util`.
+    """
+    return _json_encoder.encode(data)
+
+
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ocid", "cmpid", "ref"}
+
+
+def normalize_url(url: str) -> str:
+    """Return a canonical form of an article URL to compare and cache articles by.
+
+    The scheme and host are lowercased, the fragment, tracking parameters (utm_* and
+    TRACKING_PARAMS) and a trailing slash are removed and the remaining query is sorted.
+    """
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), "")
+    )
 
 
 allowed_file_types = lambda filename: "." in filename and filename.rsplit(".", 1)[
@@ -60,6 +158,32 @@ def format_html(text):
     return text
 
 
+def parse_frequency(frequency) -> list:
+    """Return the weekdays of a frequency, the admin stores it as a JSON string."""
+    if isinstance(frequency, str):
+        frequency = json.loads(frequency)
+    return list(frequency)
+
+
+def get_send_slot(time, timezone, frequency) -> dict:
+    """Return the UTC send slot and the UTC weekdays of a subscriber.
+
+    The local hour is converted with the current UTC offset of the timezone, so the result
+    changes on DST transitions and has to be refreshed by the `update-send-slots` command.
+    When the conversion crosses midnight the weekdays of the frequency are shifted as well,
+    a weekday subscriber in Tokyo receives the Monday email on Sunday UTC.
+    """
+    local_time = arrow.now(timezone).replace(
+        hour=int(time), minute=0, second=0, microsecond=0
+    )
+    utc_time = local_time.to("utc")
+    day_shift = (utc_time.date() - local_time.date()).days
+    send_days = sorted(
+        (int(day) - 1 + day_shift) % 7 + 1 for day in parse_frequency(frequency)
+    )
+    return {"send_slot": utc_time.strftime("%H:%M"), "send_days": send_days}
+
+
 def random_language_greeting():
     json = {
         "english": "Good Morning",
@@ -86,3 +210,85 @@ def random_language_greeting():
     }
     language, value = random.choice(list(json.items()))
     return language.capitalize(), value
+
+
+def cached(ttl, refresh_ahead=0.2, timeout=60):
+    """Cache the results of a function for `ttl` seconds, per arguments.
+
+    `ttl` can also be a callable returning the number of seconds for a result. A result
+    requested during the last `refresh_ahead` part of its lifetime, or after it expired, is
+    returned right away while it's refreshed in the background, and it's kept if refreshing it
+    fails. Only calls without a result wait for the function, at most `timeout` seconds, and
+    concurrent ones share a single call. `peek` returns the result without ever waiting, None
+    if there is none yet.
+    The function runs in the app context of the caller, also when it's refreshed in the
+    background.
+    """
+
+    def decorator(func):
+        entries = {}  # key: (value, refresh time)
+        calls = {}  # key: Future of the running call
+        lock = threading.Lock()
+
+        def refresh(key, args, kwargs, app):
+            future = calls[key]
+            try:
+                with app.app_context():
+                    value = func(*args, **kwargs)
+            except Exception as e:
+                if key in entries:
+                    print(
+                        f"Failed to refresh {func.__name__}, using the old result: "
+                        f"{str(e) or type(e).__name__}"
+                    )
+                future.set_exception(e)
+            else:
+                lifetime = ttl(value) if callable(ttl) else ttl
+                with lock:
+                    entries[key] = (
+                        value,
+                        time.monotonic() + lifetime * (1 - refresh_ahead),
+                    )
+                future.set_result(value)
+            finally:
+                with lock:
+                    del calls[key]
+
+        def lookup(args, kwargs):
+            """Return the entry and the running call, starting one if the entry is due."""
+            key = (args, tuple(sorted(kwargs.items())))
+            with lock:
+                entry = entries.get(key)
+                future = calls.get(key)
+                start = future is None and (
+                    entry is None or time.monotonic() >= entry[1]
+                )
+                if start:
+                    future = calls[key] = Future()
+            if start:
+                # the call runs in its own thread, so a hanging call can't block the callers
+                # for longer than `timeout`
+                refresh_args = (key, args, kwargs, current_app._get_current_object())
+                threading.Thread(target=refresh, args=refresh_args, daemon=True).start()
+            return entry, future
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            entry, future = lookup(args, kwargs)
+            if entry is not None:
+                return entry[0]
+            return future.result(timeout=timeout)
+
+        def peek(*args, **kwargs):
+            entry, _ = lookup(args, kwargs)
+            return entry[0] if entry is not None else None
+
+        def cache_clear():
+            with lock:
+                entries.clear()
+
+        wrapper.peek = peek
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
@@ -2,7 +2,6 @@ import datetime
 
 import pymongo
 import pytz
-from bson.objectid import ObjectId
 
 from flask import Flask, Blueprint, current_app
 from flask_admin import BaseView, expose
@@ -10,6 +9,10 @@ from flask_login import current_user
 
 from .. import admin
 from .. import mongo
+from ..api_keys import api_keys
+from ..utils import get_send_slot, parse_frequency, render_article
+from ..window import bump_version
+from ..writer_cache import get_writer
 
 from wtforms import form, fields
 
@@ -23,11 +26,7 @@ bp = Blueprint("admins", __name__, url_prefix="/admin")
 
 class SecureModelView(ModelView):
     def is_accessible(self):
-        if current_user.is_authenticated:
-            current_user.writer = mongo.db.writers.find_one(
-                {"_id": ObjectId(current_user.id)}
-            )
-        else:
+        if not current_user.is_authenticated:
             return False
 
         return current_user.writer["email"] in current_app.config["ADMIN_USER_EMAILS"]
@@ -66,6 +65,18 @@ class UserView(SecureModelView):
 
     form = UserForm
 
+    def on_model_change(self, form, model, is_created):
+        # keep the precomputed send slot in sync with the edited time settings
+        model["frequency"] = parse_frequency(model["frequency"])
+        model.update(
+            get_send_slot(model["time"], model["timezone"], model["frequency"])
+        )
+
+    def after_model_delete(self, model):
+        # the API key of the user stops working right away
+        api_keys.forget(model["_id"])
+        mongo.db.webhooks.delete_many({"api_key": model["_id"]})
+
 
 class ArticleForm(form.Form):
     title = fields.StringField("title")
@@ -131,6 +142,19 @@ class ArticleView(SecureModelView):
 
     form = ArticleForm
 
+    def on_model_change(self, form, model, is_created):
+        rendered = render_article(model)
+        # the edited article replaces the stored one, drop the HTML of removed content
+        if "content_html" not in rendered:
+            model.pop("content_html", None)
+        model.update(rendered)
+
+    def after_model_change(self, form, model, is_created):
+        bump_version()
+
+    def after_model_delete(self, model):
+        bump_version()
+
 
 class WriterForm(form.Form):
     about = fields.TextAreaField("about")
@@ -179,6 +203,12 @@ class WriterView(SecureModelView):
 
     form = WriterForm
 
+    def after_model_change(self, form, model, is_created):
+        get_writer.cache_clear()
+
+    def after_model_delete(self, model):
+        get_writer.cache_clear()
+
 
 admin.add_view(UserView(mongo.db.users, "Users"))
 admin.add_view(ArticleView(mongo.db.articles, "Articles"))
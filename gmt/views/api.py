@@ -1,23 +1,31 @@
+import base64
+import binascii
 import datetime
+import math
+import time
+import zlib
 
+import pymongo
 from bson import ObjectId
+from bson.errors import InvalidId
 from flask import Blueprint, Response, render_template, request, current_app
-from flask_login import current_user
 from flask_mail import Message
 
-from gmt import mongo, mail
-from gmt.utils import parse_json
+from gmt import mongo, mail, csrf
+from gmt.api_keys import api_keys
+from gmt.counters import api_throttles
+from gmt.ratelimit import retry_after
+from gmt.utils import ARTICLE_FIELDS, to_json
+from gmt.webhooks import MAX_WEBHOOKS, is_public_url
+from gmt.window import MAX_AGE, get_cached_version
 
 bp = Blueprint("api", __name__)
+MAX_LIMIT = 100  # articles per page at most
+EPOCH = datetime.datetime(1970, 1, 1)
 
 
 @bp.route("/api/", methods=("POST", "GET"))
 def api():
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
-
     if request.method == "POST":
         user_email = request.form.get("email")
 
@@ -44,41 +52,184 @@ def api():
     return render_template("api/api.html", error=None)
 
 
+def encode_cursor(article: dict) -> str:
+    """Return the cursor of the page after `article`, an opaque string to clients."""
+    timestamp = (article["date"] - EPOCH) // datetime.timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(f"{timestamp}:{article['_id']}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Return the (date, _id) of a cursor, raise ValueError if it's invalid."""
+    try:
+        timestamp, article_id = base64.urlsafe_b64decode(cursor).decode().split(":")
+        date = EPOCH + datetime.timedelta(milliseconds=int(timestamp))
+        return date, ObjectId(article_id)
+    except (
+        binascii.Error,
+        UnicodeDecodeError,
+        TypeError,
+        OverflowError,
+        InvalidId,
+    ) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
 @bp.route("/api/news/")
 def news():
+    """Return the articles of the last 25 hours, newest first.
+
+    The URL parameters are all optional:
+    - sources: comma separated list of sources.
+    - fields: comma separated list of ARTICLE_FIELDS to return, `_id` is always returned.
+    - limit: the number of articles per page, at most MAX_LIMIT. Without it the whole window
+      is returned at once.
+    - cursor: the `X-Next-Cursor` header of the previous page, set when there may be more.
+
+    With `Accept: application/x-ndjson` (or `format=ndjson`) the articles are streamed from the
+    database cursor as one JSON document per line, instead of a JSON array.
+
+    Every API key may call the endpoint API_RATE_LIMIT times per minute, with bursts of
+    API_RATE_BURST calls, further calls get a 429 with a Retry-After header.
+
+    Responses carry an ETag made of the articles version, the parameters and the MAX_AGE
+    period the window is in. A client sending it back in `If-None-Match` gets a 304 without
+    the articles being queried while nothing changed.
+    """
     api_key = request.headers.get("X-API-KEY")
-    if not api_key:
+    # if the key is malformed or the user with that id isn't in the db, return 401
+    if not api_key or not api_keys.is_valid(api_key):
         return Response(status=401)
 
-    user = mongo.db.users.find_one({"_id": ObjectId(api_key)})
-    # if the user with that id isn't in the db, return 401
-    if not user:
-        return Response(status=401)
+    wait = retry_after(api_key)
+    if wait:
+        api_throttles.hit(ObjectId(api_key))
+        return Response(
+            "Too many requests", status=429, headers={"Retry-After": math.ceil(wait)}
+        )
 
+    ndjson = (
+        request.args.get("format") == "ndjson"
+        or request.accept_mimetypes.best == "application/x-ndjson"
+    )
+    # the window moves on, so the same articles aren't reused for more than MAX_AGE seconds
+    etag = "{}-{}-{:x}".format(
+        get_cached_version(),
+        int(time.time() // MAX_AGE),
+        zlib.crc32(request.query_string + (b"|ndjson" if ndjson else b"")),
+    )
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    query = {
+        "date": {"$gte": datetime.datetime.utcnow() - datetime.timedelta(hours=25)}
+    }
     sources = request.args.get("sources")
     if sources:
-        sources = sources.split(",")
-        posts = list(
-            mongo.db.articles.find(
-                {
-                    "source": {"$in": sources},
-                    "date": {
-                        "$gte": datetime.datetime.utcnow()
-                        - datetime.timedelta(hours=25)
-                    },
-                }
-            )
+        query["source"] = {"$in": sources.split(",")}
+
+    fields = request.args.get("fields")
+    fields = fields.split(",") if fields else ARTICLE_FIELDS
+    if not set(fields) <= set(ARTICLE_FIELDS):
+        return Response("Unknown fields", status=400)
+
+    try:
+        limit = request.args.get("limit")
+        if limit is not None:
+            limit = int(limit)
+            if not 0 < limit <= MAX_LIMIT:
+                raise ValueError(f"The limit must be between 1 and {MAX_LIMIT}")
+        cursor = request.args.get("cursor")
+        if cursor:
+            date, article_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"date": {"$lt": date}},
+                {"date": date, "_id": {"$lt": article_id}},
+            ]
+    except ValueError as e:
+        return Response(str(e), status=400)
+
+    # the date is needed for the next cursor even when the client didn't ask for it
+    projection = {field: 1 for field in (*fields, "date")}
+    posts = mongo.db.articles.find(query, projection).sort(
+        [("date", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+    )
+    next_cursor = None
+    if limit:
+        posts = list(posts.limit(limit))
+        if len(posts) == limit:
+            next_cursor = encode_cursor(posts[-1])
+    if "date" not in fields:
+        posts = ({k: v for k, v in post.items() if k != "date"} for post in posts)
+
+    if ndjson:
+        # the articles are written as they are read, the window is never held in memory
+        response = Response(
+            (to_json(post) + "\n" for post in posts),
+            mimetype="application/x-ndjson",
         )
     else:
-        posts = list(
-            mongo.db.articles.find(
-                {
-                    "date": {
-                        "$gte": datetime.datetime.utcnow()
-                        - datetime.timedelta(hours=25)
-                    }
-                }
+        response = Response(to_json(list(posts)), mimetype="application/json")
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    response.set_etag(etag)
+    response.vary.add("Accept")
+    return response
+
+
+@bp.route("/api/webhooks/", methods=("GET", "POST", "DELETE"))
+@csrf.exempt
+def webhooks():
+    """Manage the webhooks of an API key.
+
+    - GET: list the webhooks.
+    - POST: register a webhook, with a JSON body like
+      `{"url": "https://example.com/news", "sources": ["bbc", "gmt"]}`. The sources are
+      optional, without them the webhook gets the articles of all sources.
+    - DELETE: remove the webhook with the `url` URL parameter.
+    """
+    api_key = request.headers.get("X-API-KEY")
+    if not api_key or not api_keys.is_valid(api_key):
+        return Response(status=401)
+    owner = ObjectId(api_key)
+
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        url, sources = data.get("url"), data.get("sources")
+        if not isinstance(url, str) or not is_public_url(url):
+            return Response("The url must be a public HTTP(S) URL", status=400)
+        if sources is not None and (
+            not isinstance(sources, list)
+            or not all(isinstance(source, str) for source in sources)
+        ):
+            return Response("The sources must be a list of sources", status=400)
+        if (
+            not mongo.db.webhooks.find_one({"api_key": owner, "url": url})
+            and mongo.db.webhooks.count_documents({"api_key": owner}) >= MAX_WEBHOOKS
+        ):
+            return Response(
+                f"An API key can have at most {MAX_WEBHOOKS} webhooks", status=400
             )
+
+        mongo.db.webhooks.update_one(
+            {"api_key": owner, "url": url},
+            {
+                "$set": {"sources": sources},
+                "$setOnInsert": {"created_at": datetime.datetime.utcnow()},
+            },
+            upsert=True,
+        )
+        return Response(status=201)
+
+    if request.method == "DELETE":
+        result = mongo.db.webhooks.delete_one(
+            {"api_key": owner, "url": request.args.get("url")}
         )
+        return Response(status=204 if result.deleted_count else 404)
 
-    return parse_json(posts)
+    hooks = mongo.db.webhooks.find(
+        {"api_key": owner}, {"_id": 0, "url": 1, "sources": 1, "created_at": 1}
+    )
+    return Response(to_json(list(hooks)), mimetype="application/json")
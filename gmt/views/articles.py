@@ -15,18 +15,15 @@ from datetime import datetime
 from flask_login import login_required, current_user
 
 from .. import mongo
-from ..utils import clean_html, upload_file
+from ..counters import article_views
+from ..utils import clean_html, render_article, upload_file
+from ..window import bump_version
 
 bp = Blueprint("articles", __name__, url_prefix="/articles")
 
 
 @bp.route("/<article_id>", methods=("POST", "GET"))
 def article(article_id):
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
-
     article_db = mongo.db.articles.find_one({"_id": ObjectId(article_id)})
     # if article doesnt exists 404
     if not article_db:
@@ -36,16 +33,19 @@ def article(article_id):
         # DELETES ARTICLE
         if current_user.is_authenticated:
             mongo.db.articles.delete_one({"_id": ObjectId(article_id)})
+            bump_version()
             return redirect(url_for("writers.portal"))
 
-    content_md = markdown.markdown(article_db["content"])
+    # rendered when the article is written, see `render_article`
+    content_md = article_db.get("content_html") or markdown.markdown(
+        article_db["content"]
+    )
 
     date = article_db["date"].strftime("%d %B %Y")
 
+    # the view is written to the database later, together with other views
+    article_views.hit(article_db["_id"])
     article_db["views"] = int(article_db["views"]) + 1
-    mongo.db.articles.update_one(
-        {"_id": ObjectId(article_id)}, {"$set": {"views": article_db["views"]}}
-    )
 
     return render_template(
         "articles/article.html",
@@ -59,8 +59,6 @@ def article(article_id):
 @bp.route("/edit/<article_id>", methods=("POST", "GET"))
 @login_required
 def edit(article_id):
-    current_user.writer = mongo.db.writers.find_one({"_id": ObjectId(current_user.id)})
-
     article_db = mongo.db.articles.find_one({"_id": ObjectId(article_id)})
     if not article_db:
         return render_template("404.html")
@@ -110,17 +108,15 @@ def edit(article_id):
                     article=article_db,
                 )
 
-        mongo.db.articles.update_one(
-            {"_id": ObjectId(article_id)},
-            {
-                "$set": {
-                    "title": title,
-                    "description": description,
-                    "content": clean_html(content),
-                    "categories": categories,
-                }
-            },
-        )
+        article = {
+            "title": title,
+            "description": description,
+            "content": clean_html(content),
+            "categories": categories,
+        }
+        article.update(render_article(article))
+        mongo.db.articles.update_one({"_id": ObjectId(article_id)}, {"$set": article})
+        bump_version()
         return redirect(url_for("articles.article", article_id=article_id))
 
     return render_template("articles/edit.html", article=article_db)
@@ -3,7 +3,6 @@ from urllib.parse import unquote_plus
 
 import pytz
 import requests
-from bson import ObjectId
 
 from email_validator import validate_email, EmailNotValidError
 from flask import (
@@ -16,22 +15,19 @@ from flask import (
     session,
     url_for,
 )
-from flask_login import current_user
 from flask_mail import Message
 from itsdangerous import URLSafeTimedSerializer
 from itsdangerous.exc import BadSignature, SignatureExpired
 
 from .. import mail, mongo
+from ..api_keys import api_keys
+from ..utils import get_send_slot
 
 bp = Blueprint("auth", __name__)
 
 
 @bp.route("/subscribe", methods=("GET", "POST"))
 def subscribe():
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
     error = None
     timezones = pytz.all_timezones
     if request.method == "POST":
@@ -121,6 +117,7 @@ def subscribe():
                 "timezone": timezone,
                 "theme": theme,
             }
+            user.update(get_send_slot(time, timezone, frequency))
 
             # Insert the user
             if not mongo.db.users.find_one({"email": email}):
@@ -171,10 +168,6 @@ def subscribe():
 
 @bp.route("/settings", methods=("GET", "POST"))
 def settings():
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
     error = None
     timezones = pytz.all_timezones
 
@@ -259,6 +252,7 @@ def settings():
                         "timezone": timezone,
                         "theme": theme,
                     }
+                    user.update(get_send_slot(time, timezone, frequency))
 
                     mongo.db.users.update_one({"email": email}, {"$set": user})
 
@@ -361,10 +355,6 @@ def settings():
 
 @bp.route("/unsubscribe", methods=("POST", "GET"))
 def unsubscribe():
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
     error = None
     if request.method == "POST":
         # Get and validate the email
@@ -391,6 +381,8 @@ def unsubscribe():
 
             # Delete the user
             mongo.db.users.delete_one(user)
+            api_keys.forget(user["_id"])
+            mongo.db.webhooks.delete_many({"api_key": user["_id"]})
 
             session["confirmed"] = {"email": email, "confirmed": False}
 
@@ -406,10 +398,6 @@ def confirm(email: str):
     """Send a confirmation email to the user and confirms the email if the user clicks on the link
     SUPPLY 'next' argument to redirect it there after the email got confirmed. example: next='views.register'
     """
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
     # next is where the user will be redirected after confirming
     next = request.args.get("next")
     email = unquote_plus(email)
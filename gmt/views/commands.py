@@ -1,29 +1,43 @@
 """Flask commands.
 
 This file contains Flask commands that can be executed from the command line.
-At the moment this only contains a command that can be run from a cron job that has been
-set up with GitHub Actions.
+Most of them are run from cron jobs that have been set up with GitHub Actions, the
+summarization worker is meant to be kept running next to them.
 """
 
 import datetime
-from time import sleep
 
 import arrow
 import json
 import os
 import random
-import re
+from urllib.parse import urlparse
 
+import click
 import openai
+import pymongo
 import requests
 from flask import Blueprint, render_template, current_app
 from flask_mail import Message
 from markdown import markdown
-
-from .. import mail, mongo
-from ..extras import get_trending_repos, get_daily_coding_challenge, get_surprise
-from ..news import get_news
-from ..utils import random_language_greeting
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .. import mongo
+from ..extras import get_extras
+from ..indexes import check_queries, create_indexes
+from ..mailer import send_messages
+from ..news import get_fresh_news, iter_new_posts, parser_cache
+from ..summarizer import DEFAULT_WORKER_URL, load_summarizer, serve, summarize
+from ..utils import (
+    get_send_slot,
+    normalize_url,
+    parse_frequency,
+    random_language_greeting,
+    render_article,
+)
+from ..webhooks import deliver
+from ..window import bump_version
 
 bp = Blueprint("commands", __name__)
 API_URL = "https://api-inference.huggingface.co/models/facebook/bart-large-cnn"
@@ -49,49 +63,123 @@ def get_current_time() -> str:
     return current_time
 
 
+def plan_deliveries(run: str, configs: dict) -> None:
+    """Record the chunks of a batch in the delivery ledger.
+
+    The recipients of every config are split into chunks of MAIL_BCC_CHUNK_SIZE addresses,
+    each chunk is sent as its own email and marked as sent in the ledger once it went out.
+    """
+    chunk_size = current_app.config.get("MAIL_BCC_CHUNK_SIZE") or 50
+    create_indexes(["deliveries"])
+
+    chunks = []
+    for config, emails in configs.items():
+        emails = sorted(emails)
+        for i in range(0, len(emails), chunk_size):
+            chunks.append(
+                {
+                    "run": run,
+                    "config": config,
+                    "emails": emails[i : i + chunk_size],
+                    "sent": False,
+                    "date": datetime.datetime.utcnow(),
+                }
+            )
+    if chunks:
+        mongo.db.deliveries.insert_many(chunks)
+
+
 @bp.cli.command()
-def send_emails() -> None:
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Finish the last interrupted batch instead of starting a new one.",
+)
+def send_emails(resume: bool) -> None:
     """Send the emails.
 
     The function will send the emails containing the rendered template of the daily news
     to every confirmed user in the database.
+    Every batch is claimed in the `email_runs` collection and recorded in the delivery ledger,
+    a batch can only be started once, even by overlapping invocations. If it
+    gets interrupted run the command with `--resume` to send only the chunks that are missing,
+    this only works for the latest batch and on the day it was started.
     """
-    current_time = get_current_time()
-    print(f"Sending email batch of {current_time} UTC")
+    if resume:
+        # only the latest batch can be resumed, and only on its day, so nobody gets the
+        # articles of another day or a digest they already got from a later batch
+        last_run = mongo.db.deliveries.find_one({}, sort=[("date", pymongo.DESCENDING)])
+        if not last_run or not last_run["run"].startswith(
+            f"{datetime.datetime.utcnow():%Y-%m-%d}"
+        ):
+            print("There is no email batch of today to resume")
+            return
+        run = last_run["run"]
+        if not mongo.db.deliveries.find_one({"run": run, "sent": False}):
+            print(f"The email batch of {run} UTC is already complete")
+            return
+        print(f"Resuming email batch of {run} UTC")
+    else:
+        current_time = get_current_time()
+        run = f"{datetime.datetime.utcnow():%Y-%m-%d} {current_time}"
+        print(f"Sending email batch of {current_time} UTC")
+
+        # claim the batch before planning it, so overlapping invocations can't both send it
+        create_indexes(["email_runs"])
+        try:
+            mongo.db.email_runs.insert_one(
+                {"_id": run, "date": datetime.datetime.utcnow()}
+            )
+        except DuplicateKeyError:
+            print(
+                f"The batch of {run} UTC was already started, use --resume to finish it"
+            )
+            return
+
+        # the send slot and the weekdays are precomputed in UTC, see `update_send_slots`
+        users = mongo.db.users.find(
+            {
+                "confirmed": True,
+                "send_slot": current_time,
+                "send_days": datetime.datetime.utcnow().isoweekday(),
+            },
+            {"email": 1, "news": 1, "extras": 1, "theme": 1},
+        )
+        users = list(users)
 
-    all_users = mongo.db.users.find({"confirmed": True})
-    all_users = list(all_users)
+        print(f"Email will be sent to: {len(users)} User{'s' if len(users)!=1 else ''}")
 
-    users = []
-    for user in all_users:
-        local_time = arrow.now(user["timezone"])
-        utc_time = local_time.replace(hour=int(user["time"]), minute=0).to("utc")
-        utc_time = utc_time.strftime("%H:%M")
-        if utc_time == current_time:
-            users.append(user)
+        configs = {}
+        for user in users:
+            # appends all the options into a string and separates news and extras with a '|'
+            user_string = ""
+            user_string += " ".join(user["news"])
+            user_string += "|"
+            user_string += " ".join(user["extras"])
+            user_string += "|"
+            user_string += user["theme"]
 
-    print(f"Email will be sent to: {len(users)} User{'s' if len(users)!=1 else ''}")
+            # if the unique config is not already stored add it to the dictionary
+            if user_string not in configs:
+                configs[user_string] = [user["email"]]
+            else:
+                configs[user_string].append(user["email"])
 
+        plan_deliveries(run, configs)
+
+    # group the chunks that still have to be sent by their config
     configs = {}
-    for user in users:
-        # if the user has a frequency and the current day is not in the frequency skip the user
-        if not datetime.datetime.utcnow().weekday() + 1 in user["frequency"]:
-            continue
-        # appends all the options into a string and separates news and extras with a '|'
-        user_string = ""
-        user_string += " ".join(user["news"])
-        user_string += "|"
-        user_string += " ".join(user["extras"])
-        user_string += "|"
-        user_string += user["theme"]
-
-        # if the unique config is not already stored add it to the dictionary
-        if user_string not in configs:
-            configs[user_string] = [user["email"]]
-        else:
-            configs[user_string].append(user["email"])
+    for chunk in mongo.db.deliveries.find({"run": run, "sent": False}):
+        configs.setdefault(chunk["config"], []).append(chunk)
 
-    for config, emails in configs.items():
+    # fetch the extras once, so every config gets the same repos, challenge and surprise
+    extras_snapshot = get_extras(
+        extra for config in configs for extra in config.split("|")[1].split(" ")
+    )
+
+    messages = []
+    chunk_ids = {}
+    for config, chunks in configs.items():
         sources = config.split("|")[0].split(" ")
         extras = config.split("|")[1].split(" ")
         theme = config.split("|")[2]
@@ -144,11 +232,13 @@ def send_emails() -> None:
             theme=theme,
             markdown=markdown,
             domain_name=current_app.config["DOMAIN_NAME"],
-            repos=get_trending_repos() if "repositories" in extras else None,
-            coding_challenge=get_daily_coding_challenge()
+            repos=extras_snapshot.get("repositories")
+            if "repositories" in extras
+            else None,
+            coding_challenge=extras_snapshot.get("codingchallenge")
             if "codingchallenge" in extras
             else None,
-            surprise=get_surprise() if "surprise" in extras else None,
+            surprise=extras_snapshot.get("surprise") if "surprise" in extras else None,
             random_language_greeting=random_language_greeting(),
         )
 
@@ -170,103 +260,229 @@ def send_emails() -> None:
         #     continue
         subject = "Good Morning Tech"
 
-        msg = Message(
-            subject,
-            sender=("Good Morning Tech", current_app.config["MAIL_USERNAME"]),
-            bcc=emails,
-            html=html,
+        for chunk in chunks:
+            msg = Message(
+                subject,
+                sender=("Good Morning Tech", current_app.config["MAIL_USERNAME"]),
+                bcc=chunk["emails"],
+                html=html,
+            )
+            messages.append(msg)
+            chunk_ids[id(msg)] = chunk["_id"]
+
+    def mark_sent(msg):
+        mongo.db.deliveries.update_one(
+            {"_id": chunk_ids[id(msg)]}, {"$set": {"sent": True}}
         )
-        mail.send(msg)
+
+    send_messages(messages, on_sent=mark_sent)
+
+
+@bp.cli.command()
+def update_send_slots() -> None:
+    """Recompute the UTC send slots of all users.
+
+    UTC offsets move on DST transitions, this should run once a day so the precomputed
+    `send_slot` and `send_days` fields used by `send_emails` stay correct. Users sharing a
+    timezone, time and frequency are updated together. Frequencies stored as JSON strings by the
+    admin are written back as lists.
+    """
+    create_indexes(["users"])
+
+    groups = mongo.db.users.aggregate(
+        [
+            {
+                "$group": {
+                    "_id": {
+                        "time": "$time",
+                        "timezone": "$timezone",
+                        "frequency": "$frequency",
+                    }
+                }
+            }
+        ]
+    )
+
+    updated = 0
+    for group in groups:
+        settings = group["_id"]
+        if None in (
+            settings.get("time"),
+            settings.get("timezone"),
+            settings.get("frequency"),
+        ):
+            continue
+        try:
+            frequency = parse_frequency(settings["frequency"])
+            slot = get_send_slot(settings["time"], settings["timezone"], frequency)
+        except (ValueError, TypeError) as e:
+            print(f"Skipped the users with the settings {settings}: {e}")
+            continue
+        result = mongo.db.users.update_many(
+            {
+                "time": settings["time"],
+                "timezone": settings["timezone"],
+                "frequency": settings["frequency"],
+                "$or": [
+                    {"frequency": {"$ne": frequency}},
+                    {"send_slot": {"$ne": slot["send_slot"]}},
+                    {"send_days": {"$ne": slot["send_days"]}},
+                ],
+            },
+            {"$set": {"frequency": frequency, **slot}},
+        )
+        updated += result.modified_count
+
+    print(f"Updated the send slot of {updated} User{'s' if updated!=1 else ''}")
+
+
+@bp.cli.command("create-indexes")
+@click.option(
+    "--check",
+    is_flag=True,
+    help="Explain the frequent queries and report the ones not using an index.",
+)
+def create_indexes_command(check: bool) -> None:
+    """Build the indexes of all collections.
+
+    The indexes are declared in `gmt/indexes.py`, building them again does nothing. With
+    `--check` nothing is built, the declared queries are explained instead and the ones that
+    scan a whole collection or sort in memory are reported.
+    """
+    if not check:
+        failed = create_indexes()
+        print(f"Built the indexes, {failed} failed")
+        return
+
+    problems = check_queries()
+    for collection, query, sort, stages in problems:
+        print(
+            f"{collection}.find({query})"
+            + (f".sort({sort})" if sort else "")
+            + f": {', '.join(sorted(stages))}"
+        )
+    print(f"{len(problems)} slow quer{'ies' if len(problems)!=1 else 'y'}")
+
+
+@bp.cli.command()
+@click.option(
+    "--all",
+    "render_all",
+    is_flag=True,
+    help="Render every article, not only the unrendered ones.",
+)
+def render_articles(render_all: bool) -> None:
+    """Render the HTML fields of the articles.
+
+    Articles are rendered when they are written, this fills the fields of the articles
+    written before that, or of all articles with `--all`.
+    """
+    query = {} if render_all else {"teaser_html": {"$exists": False}}
+    articles = mongo.db.articles.find(query, {"description": 1, "content": 1})
+    updates = [
+        UpdateOne({"_id": article["_id"]}, {"$set": render_article(article)})
+        for article in articles
+    ]
+    if updates:
+        mongo.db.articles.bulk_write(updates, ordered=False)
+    print(f"Rendered {len(updates)} article{'s' if len(updates)!=1 else ''}")
+
+
+@bp.cli.command()
+@click.option("--host", help="The host to listen on, taken from SUMMARIZER_URL.")
+@click.option(
+    "--port", type=int, help="The port to listen on, taken from SUMMARIZER_URL."
+)
+def summarizer_worker(host: str, port: int) -> None:
+    """Run the summarization worker.
+
+    The worker keeps the model loaded, `summarize_news` uses it instead of loading the model
+    itself while it's running.
+    """
+    url = urlparse(current_app.config.get("SUMMARIZER_URL") or DEFAULT_WORKER_URL)
+    serve(host or url.hostname, port or url.port)
 
 
 @bp.cli.command()
 def summarize_news():
-    """Summarize the news."""
+    """Summarize the news.
+
+    Up to 8 new articles of every source are summarized. The feed entries go through a lazy
+    pipeline: entries already in the database are dropped by URL before anything else, then
+    only as many entries as a source still needs are parsed, filtered by date and summarized
+    in batches. A source that comes up short, because an article was too old or its summary
+    failed, gets its next entries in another round.
+    """
     summarized_news_collection = []
+    # articles are deduplicated by their normalized URL
+    create_indexes(["articles", "parser_cache"])
     old_news = mongo.db.articles.find(
         {
             "source": {"$ne": "gmt"},
-        }
+        },
+        {"url": 1, "url_key": 1},
     )
-    old_news_urls = [news["url"] for news in list(old_news)]
-    from transformers import pipeline
+    old_news_keys = {
+        news.get("url_key") or normalize_url(news["url"]) for news in old_news
+    }
 
-    summarizer = pipeline(
-        "summarization",
-        model="facebook/bart-large-cnn",
-    )
     print("Summarizing news...")
     with open("rss.json") as f:
         rss = json.load(f)
-        for key, value in rss.items():
-            if key.startswith("_"):
-                continue
-            raw_news = get_news(key, 16)
-            news_amount = 0
-            for news in raw_news:
-                if (
-                    news["url"] in summarized_news_collection
-                    or news["url"] in old_news_urls
-                ):
-                    continue
-                elif news_amount >= 8:
-                    break
 
-                description = news["description"]
-
-                for link in re.findall(
-                    pattern=r"""(?i)\b((?:https?:(?:/{1,3}|[a-z0-9%])|[a-z0-9.\-]+[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)/)(?:[^\s()<>{}\[\]]+|\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\))+(?:\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\)|[^\s`!()\[\]{};:'".,<>?«»“”‘’])|(?:(?<!@)[a-z0-9]+(?:[.\-][a-z0-9]+)*[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)\b/?(?!@)))""",
-                    string=description,
-                ):
-                    # Replace the link with a Markdown link
-                    # description = description.replace(link, f"[link]({link})")
-                    description = description.replace(link, "")
-
-                description = re.sub(
-                    pattern=r"!?\[([^\]]*)\]\(([^\)]+)(\.jpg|\.webp|\.png)\)",
-                    repl="",
-                    string=description,
-                    flags=re.M,
-                )
-
-                try_count = 0
-                while try_count < 3:
-                    try:
-                        output = summarizer(
-                            description, max_length=300, min_length=150, truncation=True
-                        )
-                        if output[0]["summary_text"] == "":
-                            raise Exception("No text returned")
-                        sleep(20)
-                        # finish while loop
-                        break
-                    except Exception as e:
-                        try_count += 1
-                        sleep(20)
-                        print(f"Failed to summarize news, trying again {e}")
-                else:
-                    # if all tries failed, skip this news
-                    print("Failed to summarize news, skipping")
-                    continue
-
-                description = output[0]["summary_text"]
+    # the feed entries of every source that aren't in the database yet, they are only parsed
+    # and summarized while the source still needs news
+    sources = {
+        key: iter_new_posts(key, old_news_keys)
+        for key in rss
+        if not key.startswith("_")
+    }
+    news_amount = {key: 0 for key in sources}
+    summarizer = None  # only loaded once there is something to summarize
 
-                summarized_news = {
-                    "title": news["title"],
-                    "description": description,
-                    "url": news["url"],
-                    "author": news["author"],
-                    "thumbnail": news["thumbnail"],
-                    "date": datetime.datetime.utcnow(),
-                    "source": key.lower(),
-                    "formatted_source": key,
-                }
-                if not summarized_news["title"]:
+    parser_cache.reset_stats()
+    while True:
+        fresh_news = get_fresh_news(
+            sources, {key: 8 - amount for key, amount in news_amount.items()}
+        )
+        batch = []
+        for key, news_list in fresh_news.items():
+            for news in news_list:
+                if not news["title"]:
                     print("Skipped, no title")
                     continue
-                summarized_news_collection.append(summarized_news)
-                news_amount += 1
-                print("summarized")
+                batch.append((key, news))
+        if not any(fresh_news.values()):
+            break
+        elif not batch:
+            continue
+
+        if summarizer is None:
+            summarizer = load_summarizer()
+        summaries = summarize(summarizer, [news["description"] for _, news in batch])
+        for (key, news), description in zip(batch, summaries):
+            if not description:
+                print("Failed to summarize news, skipping")
+                continue
+
+            summarized_news = {
+                "title": news["title"],
+                "description": description,
+                "url": news["url"],
+                "url_key": normalize_url(news["url"]),
+                "author": news["author"],
+                "thumbnail": news["thumbnail"],
+                "date": datetime.datetime.utcnow(),
+                "source": key.lower(),
+                "formatted_source": key,
+            }
+            summarized_news.update(render_article(summarized_news))
+            summarized_news_collection.append(summarized_news)
+            news_amount[key] += 1
+        print(f"Summarized {sum(news_amount.values())} articles")
+
+    parser_cache.prune()
+    print(f"Parser cache: {parser_cache.hits} hits, {parser_cache.misses} misses")
 
     if summarized_news_collection:
         # delete all articles that are not from GMT
@@ -278,5 +494,25 @@ def summarize_news():
                 },
             }
         )
-        # insert the new articles
-        mongo.db.articles.insert_many(summarized_news_collection)
+        # insert the new articles, unless an overlapping run already inserted them
+        try:
+            result = mongo.db.articles.bulk_write(
+                [
+                    UpdateOne(
+                        {"url_key": news["url_key"]},
+                        {"$setOnInsert": news},
+                        upsert=True,
+                    )
+                    for news in summarized_news_collection
+                ],
+                ordered=False,
+            )
+            new_ids = list(result.upserted_ids.values())
+        except BulkWriteError as e:
+            # two upserts of the same url_key can race, the loser hits the unique index
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            new_ids = [upserted["_id"] for upserted in e.details["upserted"]]
+        bump_version()
+        # only the articles this run inserted are sent
+        deliver(new_ids)
@@ -5,7 +5,6 @@ import re
 
 import pytz
 import requests
-from bson import ObjectId
 from flask import (
     Blueprint,
     current_app,
@@ -19,7 +18,11 @@ from werkzeug.security import check_password_hash, generate_password_hash
 from flask_login import login_user, current_user, login_required, logout_user
 
 from .. import mongo, User
-from ..utils import clean_html, upload_file, allowed_file_types
+from ..counters import writer_views
+from ..utils import clean_html, upload_file, allowed_file_types, render_article
+from ..webhooks import deliver_in_background
+from ..window import bump_version
+from ..writer_cache import get_writer
 
 bp = Blueprint("writers", __name__, url_prefix="/writers")
 
@@ -31,10 +34,6 @@ def writers():
 
 @bp.route("/apply", methods=("POST", "GET"))
 def apply():
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
     if request.method == "POST":
         email = request.form.get("email")
         reasoning = request.form.get("reasoning")
@@ -115,10 +114,6 @@ def apply():
 
 @bp.route("/login", methods=("POST", "GET"))
 def login():
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
     if request.method == "POST":
         email = request.form["email"]
         password = request.form["password"]
@@ -141,6 +136,7 @@ def login():
 
         user = User()
         user.id = writer_db["_id"]
+        user.writer = writer_db
 
         login_user(user, remember=True)
 
@@ -157,10 +153,6 @@ def logout():
 
 @bp.route("/register", methods=("POST", "GET"))
 def register():
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
     if request.method == "POST":
         email = request.form["email"]
         password = request.form["password"]
@@ -214,6 +206,7 @@ def register():
                 }
             },
         )
+        get_writer.cache_clear()
 
         file = request.files.get("file", None)
         if file:
@@ -248,6 +241,7 @@ def register():
                     }
                 },
             )
+            get_writer.cache_clear()
             session["confirmed"] = {
                 "email": email,
                 "confirmed": False,
@@ -265,8 +259,6 @@ def register():
 @bp.route("/create", methods=("POST", "GET"))
 @login_required
 def create():
-    current_user.writer = mongo.db.writers.find_one({"_id": ObjectId(current_user.id)})
-
     if request.method == "POST":
         title = request.form["title"]
         if not title:
@@ -320,28 +312,34 @@ def create():
             "categories": categories,
             "views": 0,
         }
+        article.update(render_article(article))
 
         added_article = mongo.db.articles.insert_one(article)
-        if not upload_file(
+        uploaded = upload_file(
             file=thumbnail, filename=added_article.inserted_id, current_app=current_app
-        ):
+        )
+        if uploaded:
+            # add url to article and thumbnail URL
+            mongo.db.articles.update_one(
+                article,
+                {
+                    "$set": {
+                        "url": url_for(
+                            "articles.article", article_id=added_article.inserted_id
+                        ),
+                        "thumbnail": f"https://profile.goodmorningtech.news/{added_article.inserted_id}.jpg",
+                    }
+                },
+            )
+        # the article is published with or without its thumbnail
+        bump_version()
+        deliver_in_background([added_article.inserted_id])
+        if not uploaded:
             return render_template(
                 "writers/create.html",
                 status=f"Error uploading thumbnail! Uploaded without thumbnail,"
                 f" edit article to add one!",
             )
-        # add url to article and thumbnail URL
-        mongo.db.articles.update_one(
-            article,
-            {
-                "$set": {
-                    "url": url_for(
-                        "articles.article", article_id=added_article.inserted_id
-                    ),
-                    "thumbnail": f"https://profile.goodmorningtech.news/{added_article.inserted_id}.jpg",
-                }
-            },
-        )
         return redirect(
             url_for("articles.article", article_id=added_article.inserted_id)
         )
@@ -351,7 +349,6 @@ def create():
 @bp.route("/portal")
 @login_required
 def portal():
-    current_user.writer = mongo.db.writers.find_one({"_id": ObjectId(current_user.id)})
     articles = mongo.db.articles.find({"author.email": current_user.writer["email"]})
     writer_db = current_user.writer
     profile_picture = f"https://profile.goodmorningtech.news/{writer_db['user_name']}.jpg"  # TODO Change extension
@@ -370,19 +367,11 @@ def portal():
 
 @bp.route("/guidelines")
 def guidelines():
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
     return render_template("writers/guidelines.html")
 
 
 @bp.route("/<user_name>")
 def writer(user_name):
-    if current_user.is_authenticated:
-        current_user.writer = mongo.db.writers.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
     writer_db = mongo.db.writers.find_one(
         {"user_name": user_name, "accepted": True, "confirmed": True}
     )
@@ -391,10 +380,9 @@ def writer(user_name):
     articles = list(mongo.db.articles.find({"author.user_name": user_name}))
     random.shuffle(articles)
 
+    # the view is written to the database later, together with other views
+    writer_views.hit(user_name)
     writer_db["views"] = int(writer_db["views"]) + 1
-    mongo.db.writers.update_one(
-        {"user_name": user_name}, {"$set": {"views": writer_db["views"]}}
-    )
 
     return render_template("writers/writer.html", writer=writer_db, articles=articles)
 
@@ -403,7 +391,6 @@ def writer(user_name):
 @login_required
 def settings():
     # Check if the user is logged in
-    current_user.writer = mongo.db.writers.find_one({"_id": ObjectId(current_user.id)})
     writer_db = current_user.writer
     user_name = writer_db["user_name"]
     if request.method == "POST":
@@ -446,6 +433,7 @@ def settings():
                 }
             },
         )
+        get_writer.cache_clear()
 
         file = request.files.get("file", None)
         if file:
@@ -0,0 +1,195 @@
+"""Webhooks of the API.
+
+API consumers can register callback URLs with /api/webhooks/ instead of polling /api/news.
+After every ingestion run and every published article, the new articles are POSTed to the
+webhooks as a JSON array in the format of /api/news, at most BATCH_SIZE articles per request.
+The requests to all webhooks are sent concurrently, and failed requests are retried with
+exponential backoff.
+
+Webhooks can't point to the network of the server: the URL is checked when it's registered,
+and the connections of the deliveries are refused unless the address they reach is public,
+so a host resolving to another address later or a redirect can't reach the server's network.
+"""
+
+import datetime
+import ipaddress
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import pymongo
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from . import mongo
+from .utils import ARTICLE_FIELDS, to_json
+
+MAX_WEBHOOKS = 5  # webhooks per API key
+BATCH_SIZE = 50  # articles per request
+WORKERS = 8  # concurrent requests
+MAX_ATTEMPTS = 3
+BACKOFF = 1  # seconds before the first retry, doubled on every retry
+TIMEOUT = 10
+
+
+def is_public_address(address: str) -> bool:
+    """Return whether an IP address is on the public internet."""
+    return ipaddress.ip_address(address).is_global
+
+
+def is_public_url(url: str) -> bool:
+    """Return whether the URL is an HTTP(S) URL of a host on the public internet."""
+    parsed = urlparse(url or "")
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port or 443)
+    except (socket.gaierror, UnicodeError, ValueError):
+        return False
+    return all(is_public_address(address[4][0]) for address in addresses)
+
+
+class PublicConnectionMixin:
+    """Refuse the connections to an address that isn't public, once it's connected."""
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        address = sock.getpeername()[0]
+        if not is_public_address(address):
+            sock.close()
+            raise NewConnectionError(self, f"Refused to connect to {address}")
+        return sock
+
+
+class PublicHTTPConnection(PublicConnectionMixin, HTTPConnection):
+    pass
+
+
+class PublicHTTPSConnection(PublicConnectionMixin, HTTPSConnection):
+    pass
+
+
+class PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = PublicHTTPConnection
+
+
+class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PublicHTTPSConnection
+
+
+class PublicHTTPAdapter(HTTPAdapter):
+    """Transport adapter only connecting to public addresses."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": PublicHTTPConnectionPool,
+            "https": PublicHTTPSConnectionPool,
+        }
+
+
+session = requests.Session()
+session.mount("http://", PublicHTTPAdapter(pool_maxsize=WORKERS))
+session.mount("https://", PublicHTTPAdapter(pool_maxsize=WORKERS))
+session.headers["User-Agent"] = "Good Morning Tech webhooks"
+# a proxy of the environment would be the peer of every connection instead of the webhook
+session.trust_env = False
+
+
+def post(webhook: dict, body: str) -> bool:
+    """POST a batch to a webhook, return whether it was accepted.
+
+    Connection errors, 429 and 5xx responses are retried, other errors aren't since the
+    consumer would reject the batch again. Redirects aren't followed, they count as errors.
+    The last error is stored with the webhook.
+    """
+    error = None
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(BACKOFF * 2 ** (attempt - 1))
+        try:
+            response = session.post(
+                webhook["url"],
+                data=body,
+                headers={"Content-Type": "application/json"},
+                timeout=TIMEOUT,
+                allow_redirects=False,
+            )
+        except requests.RequestException as e:
+            error = str(e)
+            continue
+        if response.status_code < 300:
+            if webhook.get("failures"):
+                mongo.db.webhooks.update_one(
+                    {"_id": webhook["_id"]}, {"$set": {"failures": 0}}
+                )
+            return True
+        error = f"HTTP {response.status_code}"
+        if response.status_code < 500 and response.status_code != 429:
+            break
+
+    print(f"Failed to deliver to the webhook {webhook['url']}: {error}")
+    mongo.db.webhooks.update_one(
+        {"_id": webhook["_id"]},
+        {
+            "$set": {"last_error": error, "last_failure": datetime.datetime.utcnow()},
+            "$inc": {"failures": 1},
+        },
+    )
+    return False
+
+
+def deliver(article_ids) -> None:
+    """Send the articles with the given ids to every webhook.
+
+    A webhook registered with sources only gets the articles of these sources.
+    """
+    article_ids = list(article_ids)
+    if not article_ids:
+        return
+    webhooks = list(mongo.db.webhooks.find({}, {"url": 1, "sources": 1, "failures": 1}))
+    if not webhooks:
+        return
+
+    articles = list(
+        mongo.db.articles.find(
+            {"_id": {"$in": article_ids}}, {field: 1 for field in ARTICLE_FIELDS}
+        ).sort([("date", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+    )
+
+    # the batches are serialized once for all webhooks with the same sources
+    batches = {}
+    jobs = []
+    for webhook in webhooks:
+        sources = tuple(sorted(webhook.get("sources") or ()))
+        if sources not in batches:
+            selected = [
+                article
+                for article in articles
+                if not sources or article.get("source") in sources
+            ]
+            batches[sources] = [
+                to_json(selected[i : i + BATCH_SIZE])
+                for i in range(0, len(selected), BATCH_SIZE)
+            ]
+        jobs.extend((webhook, body) for body in batches[sources])
+    if not jobs:
+        return
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        results = list(executor.map(lambda job: post(*job), jobs))
+    failed = results.count(False)
+    print(
+        f"Sent {len(jobs) - failed} webhook request{'s' if len(jobs)-failed!=1 else ''}"
+        f" for {len(articles)} article{'s' if len(articles)!=1 else ''}, {failed} failed"
+    )
+
+
+def deliver_in_background(article_ids) -> None:
+    """Send the articles to the webhooks from another thread, for use in requests."""
+    threading.Thread(target=deliver, args=(list(article_ids),), daemon=True).start()
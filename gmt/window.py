@@ -0,0 +1,98 @@
+"""Snapshot of the current article window.
+
+The homepage and the newspaper draw their articles from a process-local snapshot of the articles
+of the last 25 hours, instead of querying the window on every request. The snapshot is reloaded
+when the articles version in the database is bumped, which happens whenever articles are added,
+edited or deleted, and at least every MAX_AGE seconds since the window moves on.
+"""
+
+import datetime
+import threading
+import time
+
+import pymongo
+
+from . import mongo
+from .utils import cached
+
+WINDOW = datetime.timedelta(hours=25)
+CHECK_INTERVAL = 30  # seconds between reads of the articles version
+MAX_AGE = 5 * 60  # seconds a snapshot is used at most
+FALLBACK_SIZE = 12  # latest articles used when the window is (nearly) empty
+
+
+def get_version() -> int:
+    """Return the current articles version."""
+    meta = mongo.db.meta.find_one({"_id": "articles"})
+    return meta["version"] if meta else 0
+
+
+@cached(ttl=CHECK_INTERVAL, refresh_ahead=0)
+def get_cached_version() -> int:
+    """Return the articles version, read from the database at most every CHECK_INTERVAL."""
+    return get_version()
+
+
+def bump_version() -> None:
+    """Signal that the articles changed, snapshots are reloaded on their next check."""
+    mongo.db.meta.update_one({"_id": "articles"}, {"$inc": {"version": 1}}, upsert=True)
+    get_cached_version.cache_clear()
+    article_window.expire()
+
+
+class ArticleWindow:
+    """Process-local snapshot of the articles of the last 25 hours.
+
+    If the window holds less than two articles the latest FALLBACK_SIZE articles are used, so
+    the homepage always has something to show without scraping the news on a request.
+    The articles are shared between requests, copy them before changing them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.articles = []
+        self.version = None
+        self.loaded_at = 0
+        self.checked_at = 0
+
+    def get(self) -> list:
+        now = time.monotonic()
+        if now - self.checked_at < CHECK_INTERVAL:
+            return self.articles
+
+        # while a snapshot is being reloaded the other requests keep using the old one
+        if not self.lock.acquire(blocking=self.version is None):
+            return self.articles
+        try:
+            if now - self.checked_at >= CHECK_INTERVAL:
+                version = get_version()
+                if version != self.version or now - self.loaded_at >= MAX_AGE:
+                    self.articles = self.load()
+                    self.version = version
+                    self.loaded_at = now
+                self.checked_at = now
+        finally:
+            self.lock.release()
+        return self.articles
+
+    def expire(self) -> None:
+        self.checked_at = 0
+
+    @staticmethod
+    def load() -> list:
+        projection = {"content": 0, "content_html": 0}
+        articles = list(
+            mongo.db.articles.find(
+                {"date": {"$gte": datetime.datetime.utcnow() - WINDOW}}, projection
+            )
+        )
+        if len(articles) < 2:
+            articles = list(
+                mongo.db.articles.find({}, projection)
+                .sort("date", pymongo.DESCENDING)
+                .limit(FALLBACK_SIZE)
+            )
+        return articles
+
+
+article_window = ArticleWindow()
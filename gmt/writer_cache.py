@@ -0,0 +1,19 @@
+"""Lookup of the logged in writers.
+
+The writer document is needed on every request of a logged in writer, it's cached for
+WRITER_TTL seconds instead of being read every time. Call `get_writer.cache_clear` after
+changing a writer.
+"""
+
+from bson import ObjectId
+
+from . import mongo
+from .utils import cached
+
+WRITER_TTL = 30  # seconds a writer document is reused
+
+
+@cached(ttl=WRITER_TTL, refresh_ahead=0)
+def get_writer(writer_id: str):
+    """Return the writer document, None if there is no such writer."""
+    return mongo.db.writers.find_one({"_id": ObjectId(writer_id)})
@@ -0,0 +1,164 @@
+"""Tests of the webhook deliveries, against a local HTTP server standing in for consumers."""
+
+import datetime
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mongomock
+import pytest
+
+from gmt import mongo, webhooks
+
+
+class Consumer(BaseHTTPRequestHandler):
+    """Record the batches POSTed to every path and answer with the statuses queued for it."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.batches.setdefault(self.path, []).append(json.loads(body))
+        statuses = self.server.statuses.get(self.path)
+        status = statuses.pop(0) if statuses else 200
+        self.send_response(status)
+        if 300 <= status < 400:
+            self.send_header("Location", "/redirected")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(mongo, "db", database)
+    return database
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Consumer)
+    server.batches = {}
+    server.statuses = {}
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(webhooks, "BACKOFF", 0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def loopback_allowed(monkeypatch):
+    """Let the deliveries reach the local consumer."""
+    monkeypatch.setattr(webhooks, "is_public_address", lambda address: True)
+
+
+def add_articles(db, count, source="bbc"):
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    articles = [
+        {
+            "title": f"{source} {i}",
+            "description": "description",
+            "url": f"https://example.com/{source}/{i}",
+            "source": source,
+            "date": now - datetime.timedelta(minutes=i),
+        }
+        for i in range(count)
+    ]
+    return db.articles.insert_many(articles).inserted_ids
+
+
+def add_webhook(db, url, **fields):
+    return db.webhooks.insert_one({"url": url, "api_key": "key", **fields}).inserted_id
+
+
+def test_articles_are_sent_in_batches(db, consumer, loopback_allowed):
+    ids = add_articles(db, 2 * webhooks.BATCH_SIZE + 20)
+    add_webhook(db, f"{consumer.url}/all")
+
+    webhooks.deliver(ids)
+
+    batches = consumer.batches["/all"]
+    assert sorted(len(batch) for batch in batches) == [20, 50, 50]
+    titles = [article["title"] for batch in batches for article in batch]
+    assert sorted(titles) == sorted(f"bbc {i}" for i in range(len(ids)))
+
+
+def test_webhooks_only_get_their_sources(db, consumer, loopback_allowed):
+    ids = add_articles(db, 3, "bbc") + add_articles(db, 2, "verge")
+    add_webhook(db, f"{consumer.url}/all")
+    add_webhook(db, f"{consumer.url}/verge", sources=["verge"])
+    add_webhook(db, f"{consumer.url}/cnn", sources=["cnn"])
+
+    webhooks.deliver(ids)
+
+    assert len(consumer.batches["/all"][0]) == 5
+    assert {a["source"] for a in consumer.batches["/verge"][0]} == {"verge"}
+    assert len(consumer.batches["/verge"][0]) == 2
+    assert "/cnn" not in consumer.batches
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_server_errors_are_retried(db, consumer, loopback_allowed, status):
+    ids = add_articles(db, 1)
+    webhook_id = add_webhook(db, f"{consumer.url}/flaky", failures=2)
+    consumer.statuses["/flaky"] = [status, status]
+
+    webhooks.deliver(ids)
+
+    assert len(consumer.batches["/flaky"]) == 3
+    assert db.webhooks.find_one({"_id": webhook_id})["failures"] == 0
+
+
+def test_failures_are_recorded_after_the_last_attempt(db, consumer, loopback_allowed):
+    ids = add_articles(db, 1)
+    webhook_id = add_webhook(db, f"{consumer.url}/down", failures=1)
+    consumer.statuses["/down"] = [503] * webhooks.MAX_ATTEMPTS
+
+    webhooks.deliver(ids)
+
+    assert len(consumer.batches["/down"]) == webhooks.MAX_ATTEMPTS
+    webhook = db.webhooks.find_one({"_id": webhook_id})
+    assert webhook["failures"] == 2
+    assert webhook["last_error"] == "HTTP 503"
+    assert isinstance(webhook["last_failure"], datetime.datetime)
+
+
+@pytest.mark.parametrize("status", [400, 404, 410])
+def test_client_errors_are_not_retried(db, consumer, loopback_allowed, status):
+    ids = add_articles(db, 1)
+    webhook_id = add_webhook(db, f"{consumer.url}/gone")
+    consumer.statuses["/gone"] = [status]
+
+    webhooks.deliver(ids)
+
+    assert len(consumer.batches["/gone"]) == 1
+    webhook = db.webhooks.find_one({"_id": webhook_id})
+    assert webhook["failures"] == 1
+    assert webhook["last_error"] == f"HTTP {status}"
+
+
+def test_redirects_are_not_followed(db, consumer, loopback_allowed):
+    ids = add_articles(db, 1)
+    webhook_id = add_webhook(db, f"{consumer.url}/moved")
+    consumer.statuses["/moved"] = [307]
+
+    webhooks.deliver(ids)
+
+    assert list(consumer.batches) == ["/moved"]
+    assert db.webhooks.find_one({"_id": webhook_id})["last_error"] == "HTTP 307"
+
+
+def test_private_addresses_are_refused(db, consumer):
+    ids = add_articles(db, 1)
+    webhook_id = add_webhook(db, f"{consumer.url}/private")
+
+    webhooks.deliver(ids)
+
+    assert consumer.batches == {}
+    webhook = db.webhooks.find_one({"_id": webhook_id})
+    assert webhook["failures"] == 1
+    assert "Refused to connect to 127.0.0.1" in webhook["last_error"]